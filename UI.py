@@ -1,5 +1,6 @@
 import streamlit as st
 from agent import build_agents, ModelChoice
+from agent_runner import run_agents_concurrently, stream_agent_response, AgentTimeoutError, AGENT_TIMEOUT
 from utils import process_images, logger
 from agno.media import Image as AgnoImage
 from agno.exceptions import ModelProviderError
@@ -11,11 +12,23 @@ from datetime import datetime
 import pytesseract
 from PIL import Image
 import io
-from sentence_transformers import SentenceTransformer
+import threading
+import uuid
+from embedding_service import get_embedding_model, encode, encode_query, query_cache, EMBEDDING_DIM, DEFAULT_BATCH_SIZE
+from index_manager import IndexManager, cosine_similarities, filtered_search, similarity_score, write_index_atomic
+from document_store import DocumentStore
+from bm25 import BM25Index, reciprocal_rank_fusion
+from reranker import get_reranker
+from retrieval_policy import RetrievalPolicy
+from response_cache import ResponseCache
+from router import ProviderRouter, provider_stats
+from history_store import HistoryStore
+from concurrency import SingleWriter
+from chunker import SentenceChunker
+from issue_classifier import classify_issue_type, issue_type_aliases, GENERAL
 import faiss
 import numpy as np
-import pickle
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 st.set_page_config(page_title="Emotional Recovery AI Assistant", page_icon="😀", layout="wide")
 
@@ -23,112 +36,254 @@ if "model_choice" not in st.session_state:
     st.session_state.model_choice = "gemini"
 if "api_key" not in st.session_state:
     st.session_state.api_key = ""
+if "fallback_keys" not in st.session_state:
+    st.session_state.fallback_keys = {}
+if "hedge_requests" not in st.session_state:
+    st.session_state.hedge_requests = False
 if "history" not in st.session_state:
     st.session_state.history = []
 if "enable_rag" not in st.session_state:
     st.session_state.enable_rag = True
+if "concurrent_agents" not in st.session_state:
+    st.session_state.concurrent_agents = True
+if "stream_responses" not in st.session_state:
+    st.session_state.stream_responses = True
+if "rerank" not in st.session_state:
+    st.session_state.rerank = False
+if "response_cache" not in st.session_state:
+    st.session_state.response_cache = False
+if "bypass_response_cache" not in st.session_state:
+    st.session_state.bypass_response_cache = False
+if "session_id" not in st.session_state:
+    # Kept in the URL, so reloading the page continues the session and its history
+    st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = st.session_state.session_id
+
+
+# Which references reach the {rag_context} slot: relevance threshold, adaptive k, token budget
+RAG_POLICY = RetrievalPolicy(min_similarity=0.35, max_k=3, token_budget=400)
 
 
 class RAGKnowledgeBase:
-    def __init__(self):
-        self.embedding_model = None
-        self.index = None
-        self.knowledge_base = []
+    """Knowledge base shared by every session and worker process; all writes go through one locked writer thread"""
+
+    def __init__(self, flush_delay: float = 5.0, index_path: str = "./knowledge_base/psychology_index"):
+        self.index_path = Path(index_path)
+        self.index_manager = IndexManager(EMBEDDING_DIM)
+        self.store = None
+        self.bm25 = None
         self.is_ready = False
+        self.chunker = SentenceChunker()
+        # Uncommitted additions are written to disk flush_delay seconds after the last add_many
+        self.flush_delay = flush_delay
+        self._pending: List[Tuple[List[Dict], np.ndarray, bool]] = []
+        self._flush_timer = None
+        self._lock = threading.RLock()
+        self._writer = SingleWriter("rag-index-writer", lock_path=f"{index_path}.lock")
+        self._loaded_version = None
+
+    @property
+    def index(self):
+        return self.index_manager.index
+
+    @property
+    def faiss_path(self) -> Path:
+        return self.index_path.with_suffix('.faiss')
+
+    def _file_version(self):
+        try:
+            stat = os.stat(self.faiss_path)
+        except FileNotFoundError:
+            return None
+        # An atomic replace always changes the inode
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload_if_stale(self):
+        """Re-read the index file if another process replaced it since it was loaded or saved here"""
+        version = self._file_version()
+        if self.is_ready and version is not None and version != self._loaded_version:
+            index = faiss.read_index(str(self.faiss_path))
+            with self._lock:
+                self.index_manager.attach(index)
+                self._loaded_version = version
+
+    def load_or_create(self) -> bool:
+        # The writer thread must not call Streamlit, so failures are reported here
+        try:
+            self._writer.call(self._load_or_create)
+        except Exception as e:
+            st.warning(f"加载知识库失败: {e}")
+            return False
+        return True
 
-    def load_or_create(self):
-        index_path = Path("./knowledge_base/psychology_index")
+    def _load_or_create(self):
+        index_path = self.index_path
         index_path.parent.mkdir(parents=True, exist_ok=True)
-
-        if index_path.with_suffix('.faiss').exists() and index_path.with_suffix('.pkl').exists():
-            try:
-                self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-                self.index = faiss.read_index(str(index_path.with_suffix('.faiss')))
-                with open(index_path.with_suffix('.pkl'), 'rb') as f:
-                    self.knowledge_base = pickle.load(f)
-                self.is_ready = True
-                return True
-            except Exception as e:
-                st.warning(f"加载知识库失败: {e}")
-                return False
+        db_path = index_path.with_suffix('.db')
+        pkl_path = index_path.with_suffix('.pkl')
+
+        if self.faiss_path.exists() and (db_path.exists() or pkl_path.exists()):
+            get_embedding_model()
+            # Not memory-mapped: the UI knowledge base keeps growing through add_many
+            self._loaded_version = self._file_version()
+            self.index_manager.attach(faiss.read_index(str(self.faiss_path)))
+            needs_migration = not db_path.exists()
+            self.store = DocumentStore(str(db_path))
+            if needs_migration:
+                self.store.import_pickle(str(pkl_path))
+            self.bm25 = BM25Index(self.store)
         else:
-            self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-            dimension = 384
-            self.index = faiss.IndexFlatL2(dimension)
-            self.is_ready = True
-            return True
-
-    def search(self, query: str, issue_type: str = None, k: int = 3) -> List[Dict]:
+            get_embedding_model()
+            self.index_manager.attach(self.index_manager.create(0))
+            self.store = DocumentStore(str(db_path))
+            self.store.clear()
+            self.bm25 = BM25Index(self.store)
+            self.bm25.clear()
+            self._save()
+        self.is_ready = True
+
+    def search(self, query: str, issue_type: str = None, k: int = 3, hybrid: bool = True,
+               rerank: bool = False, candidates: int = 12) -> List[Dict]:
+        """Dense search, fused with BM25 keyword search by reciprocal rank fusion when hybrid is set.
+
+        With rerank the top `candidates` hits are re-scored by the cross-encoder (within its
+        latency budget) before the best k are returned.
+        """
+        self._reload_if_stale()
         if not self.is_ready or self.index.ntotal == 0:
             return []
 
-        query_emb = self.embedding_model.encode([query])
-        distances, indices = self.index.search(query_emb.astype('float32'), min(k * 2, self.index.ntotal))
+        n = max(k, candidates) if rerank else k
+        query_emb = encode_query(query)
 
-        results = []
-        for idx, dist in zip(indices[0], distances[0]):
-            if idx == -1 or idx >= len(self.knowledge_base):
-                continue
+        with self._lock:
+            allowed_ids = None
+            if issue_type:
+                # Only documents of this issue_type, general ones and untagged ones are eligible
+                allowed_ids = self.store.ids_for_issue_types(issue_type_aliases(issue_type) + [GENERAL])
+            distances, indices = filtered_search(self.index, query_emb, n, allowed_ids)
 
-            item = self.knowledge_base[idx]
+        hits = [(int(idx), similarity_score(self.index, dist)) for idx, dist in zip(indices[0], distances[0]) if idx != -1]
+        if hybrid:
+            sparse = self.bm25.search(query, 2 * n, allowed_ids)
+            hits = reciprocal_rank_fusion([[idx for idx, _ in hits], [idx for idx, _ in sparse]])
+        docs = self.store.get_many([idx for idx, _ in hits])
 
-            if issue_type and item.get('issue_type'):
-                if item['issue_type'] != issue_type and item['issue_type'] != 'general':
-                    continue
+        results = []
+        for (idx, score), item in zip(hits, docs):
+            if item is None:
+                continue
 
             results.append({
+                'id': idx,
                 'content': item['content'],
                 'title': item['title'],
                 'source': item.get('source', '未知'),
-                'score': float(1 / (1 + dist)),
+                'score': score,
                 'type': item.get('type', 'article')
             })
 
-            if len(results) >= k:
+            if len(results) >= n:
                 break
 
+        # Query-independent relevance for RetrievalPolicy, from the indexed vectors
+        with self._lock:
+            similarities = cosine_similarities(self.index, query_emb, [r['id'] for r in results])
+        for result, similarity in zip(results, similarities):
+            result['similarity'] = float(similarity)
+
+        if rerank:
+            results = get_reranker().rerank(query, results, top_k=k)
         return results
 
-    def add_knowledge(self, title: str, content: str, source: str = "manual", issue_type: str = "general"):
+    def add_knowledge(self, title: str, content: str, source: str = "manual", issue_type: str = "general",
+                      commit: bool = True):
+        self.add_many([{
+            'title': title,
+            'content': content,
+            'source': source,
+            'issue_type': issue_type
+        }], commit=commit)
+
+    def add_many(self, items: List[Dict], commit: bool = True, batch_size: int = DEFAULT_BATCH_SIZE,
+                 if_empty: bool = False):
+        """Queue documents ({title, content, source, issue_type}) for the writer, encoded in the caller's thread.
+
+        With commit=False they are written by commit() or the write-behind timer; with if_empty they
+        are dropped if the index is no longer empty by then.
+        """
         if not self.is_ready:
             self.load_or_create()
 
-        chunks = self._chunk_text(content, title)
-
-        for chunk in chunks:
-            emb = self.embedding_model.encode([chunk['content']])
-            self.index.add(emb.astype('float32'))
-            self.knowledge_base.append({
-                'id': len(self.knowledge_base),
-                'title': title,
-                'content': chunk['content'],
-                'source': source,
-                'issue_type': issue_type,
-                'type': 'manual'
-            })
-
-        self._save()
-
-    def _chunk_text(self, text: str, title: str, chunk_size: int = 500) -> List[Dict]:
-        chunks = []
-        words = text.split()
-
-        for i in range(0, len(words), chunk_size):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk and len(chunk) > 20:
-                chunks.append({'title': title, 'content': chunk})
-
-        if not chunks and text:
-            chunks.append({'title': title, 'content': text[:1000]})
-
-        return chunks
+        records = []
+        for item in items:
+            for chunk in self._chunk_text(item['content'], item['title']):
+                records.append({
+                    'title': item['title'],
+                    'content': chunk['content'],
+                    'source': item.get('source', 'manual'),
+                    'issue_type': item.get('issue_type', 'general'),
+                    'type': item.get('type', 'manual'),
+                    'start_idx': chunk['start_idx'],
+                    'end_idx': chunk['end_idx']
+                })
+
+        embeddings = [encode([record['content'] for record in records[start:start + batch_size]],
+                             batch_size=batch_size)
+                      for start in range(0, len(records), batch_size)]
+        if records:
+            with self._lock:
+                self._pending.append((records, np.vstack(embeddings), if_empty))
+
+        if commit:
+            self.commit()
+        else:
+            self._schedule_flush()
+
+    def commit(self):
+        """Write pending additions to the index and metadata (on the writer thread)"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        self._writer.call(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        # Another process may have written the index since it was loaded here
+        self._reload_if_stale()
+        with self._lock:
+            for records, embeddings, if_empty in pending:
+                if if_empty and self.index.ntotal > 0:
+                    continue
+                start_id = self.index.ntotal
+                self.index_manager.add(embeddings)
+                ids = self.store.add_many(records, start_id=start_id)
+                self.bm25.add_many(ids, records)
+            self._save()
+
+    def _schedule_flush(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self.flush_delay, self.commit)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _chunk_text(self, text: str, title: str) -> List[Dict]:
+        return [{'title': title, 'content': chunk['content'], 'start_idx': chunk['start'], 'end_idx': chunk['end']}
+                for chunk in self.chunker.chunk(text)]
 
     def _save(self):
-        index_path = Path("./knowledge_base/psychology_index")
-        index_path.parent.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self.index, str(index_path.with_suffix('.faiss')))
-        with open(index_path.with_suffix('.pkl'), 'wb') as f:
-            pickle.dump(self.knowledge_base, f)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        # Documents first: a reader that sees the new index can always resolve its ids
+        self.store.commit()
+        write_index_atomic(self.index, str(self.faiss_path))
+        self._loaded_version = self._file_version()
 
 
 def init_builtin_knowledge(rag):
@@ -165,68 +320,58 @@ def init_builtin_knowledge(rag):
          "source": "心理学知识库", "issue_type": "financial stress"}
     ]
 
-    for item in builtin_knowledge:
-        rag.add_knowledge(
-            title=item["title"],
-            content=item["content"],
-            source=item["source"],
-            issue_type=item["issue_type"]
-        )
+    rag.add_many(builtin_knowledge, if_empty=True)
 
     st.success("已加载内置心理学知识库！")
 
 
+@st.cache_resource
+def init_response_cache():
+    return ResponseCache()
+
+
+@st.cache_resource
+def init_reranker():
+    reranker = get_reranker()
+    reranker.warm_up()
+    return reranker
+
+
 @st.cache_resource
 def init_rag():
+    query_cache.set_disk_dir("./knowledge_base/query_cache")
     rag = RAGKnowledgeBase()
     if rag.load_or_create():
         init_builtin_knowledge(rag)
     return rag
 
 
-def classify_issue_type(text: str) -> str:
-    text_lower = text.lower() if text else ""
-
-    if any(kw in text_lower for kw in
-           ["分手", "失恋", "前任", "ex", "离婚", "Breakup", "heartbreak", "divorce"]):
-        return "romantic breakup"
-    elif any(kw in text_lower for kw in ["吵架", "争吵", "冲突", "矛盾", "绝交", "误会", "朋友", "室友", "fight",
-                                         "argument", "conflict", "quarrel", "contradiction", "Break off relations",
-                                         "misunderstanding", "friends", "roommate"]):
-        return "interpersonal conflict"
-    elif any(kw in text_lower for kw in
-             ["工作", "职场", "老板", "同事", "绩效", "加班", "kpi", "裁员", "work", "job", "career",
-              "workplace", "boss", "colleague", "performance", "overtime", "layoffs"]):
-        return "workplace stress"
-    elif any(kw in text_lower for kw in
-             ["焦虑", "抑郁", "压力", "失眠", "情绪", "心理", "难受", "anxiety", "depressed", "stress",
-              "insomnia", "emotion", "psychology", "discomfort"]):
-        return "mental health"
-    elif any(kw in text_lower for kw in
-             ["家人", "家庭", "父母", "亲戚", "沟通", "代沟", "family", "parents", "relatives",
-              "communication", "generation gap"]):
-        return "family issues"
-    elif any(k in text_lower for k in
-             ["钱", "经济", "贫穷", "债务", "买不起", "money", "economy", "poverty", "debt", "unaffordable"]):
-        return "financial stress"
-    elif any(k in text_lower for k in
-             ["考试", "挂科", "学习", "学业", "论文", "毕业", "gpa", "成绩", "exam", "fail", "study",
-              "academic", "thesis", "graduation", "grade"]):
-        return "academic anxiety"
-    else:
-        return "general emotional distress"
+@st.cache_resource
+def init_history_store():
+    # Shared by all sessions; appends are serialized across threads and processes
+    return HistoryStore()
 
 
-def save_history():
+def save_history(entry):
     try:
-        Path("conversation_history.json").write_text(
-            json.dumps(st.session_state.history, ensure_ascii=False, indent=2),
-            encoding='utf-8'
-        )
+        init_history_store().append(entry)
     except Exception as e:
         logger.error(f"Failed to save the history record: {e}")
 
 
+def load_session_history() -> list:
+    try:
+        return init_history_store().query(session_id=st.session_state.session_id)
+    except Exception as e:
+        logger.error(f"Failed to load the history records: {e}")
+        return []
+
+
+if "history_loaded" not in st.session_state:
+    st.session_state.history = load_session_history()
+    st.session_state.history_loaded = True
+
+
 with st.sidebar:
     st.header("Chat History")
     if not st.session_state.history:
@@ -246,6 +391,44 @@ with st.sidebar:
         value=st.session_state.enable_rag,
         help="Enable to retrieve psychology knowledge for better responses"
     )
+    if st.session_state.enable_rag:
+        cache_stats = query_cache.stats()
+        st.caption(
+            f"Query cache: {cache_stats['hits']} hits, {cache_stats['disk_hits']} disk hits, "
+            f"{cache_stats['misses']} misses, {cache_stats['evictions']} evictions "
+            f"(hit rate {cache_stats['hit_rate']:.0%})"
+        )
+        st.session_state.rerank = st.checkbox(
+            " Re-rank References",
+            value=st.session_state.rerank,
+            help="Re-score retrieved references with a cross-encoder (falls back to the retrieval order if it is slow)"
+        )
+    st.session_state.concurrent_agents = st.checkbox(
+        " Run Agents Concurrently",
+        value=st.session_state.concurrent_agents,
+        help="Generate all four sections at once instead of one after another"
+    )
+    st.session_state.stream_responses = st.checkbox(
+        " Stream Responses",
+        value=st.session_state.stream_responses,
+        help="Show each answer word by word while it is being generated"
+    )
+    st.session_state.response_cache = st.checkbox(
+        " Reuse Answers to Similar Questions",
+        value=st.session_state.response_cache,
+        help="Serve a cached answer when a very similar message of the same issue type was answered before"
+    )
+    if st.session_state.response_cache:
+        st.session_state.bypass_response_cache = st.checkbox(
+            " Always Generate Fresh Answers",
+            value=st.session_state.bypass_response_cache,
+            help="Skip cached answers (new answers are still cached)"
+        )
+        response_stats = init_response_cache().stats()
+        st.caption(
+            f"Response cache: {response_stats['hits']} hits, {response_stats['misses']} misses, "
+            f"{response_stats['entries']} entries (hit rate {response_stats['hit_rate']:.0%})"
+        )
     st.markdown("---")
     st.markdown("""<div style='text-align:center'><p>Created by Data Mining Group</p>
     <p>We sincerely hope that you can mend your relationship here</p></div>""", unsafe_allow_html=True)
@@ -289,6 +472,27 @@ with right_col:
             please visit: [{model_choice.upper()} Official]({links[model_choice]})
             """)
 
+        with st.expander("Fallback Providers"):
+            st.caption("Used when the selected model fails or times out, in order of recent latency")
+            for provider in ["gemini", "openai", "claude", "deepseek"]:
+                if provider == model_choice:
+                    continue
+                st.session_state.fallback_keys[provider] = st.text_input(
+                    f"{provider.upper()} API Key (optional)",
+                    value=st.session_state.fallback_keys.get(provider, ""),
+                    type="password",
+                    key=f"fallback_key_{provider}"
+                )
+            st.session_state.hedge_requests = st.checkbox(
+                " Hedge Slow Requests",
+                value=st.session_state.hedge_requests,
+                help="If the selected model has not started answering by its usual (p95) latency, also ask "
+                     "the next provider and keep whichever answers first. Slow requests may cost twice."
+            )
+            for provider, row in provider_stats.summary().items():
+                latency = f", p50 {row['p50']:.1f}s, p95 {row['p95']:.1f}s" if row['p95'] is not None else ""
+                st.caption(f"{provider}: {row['requests']} calls, {row['errors']} errors{latency}")
+
 with center_col:
     st.title("Emotional Recovery AI Assistant")
     st.markdown("""### Your personal emotional recovery AI assistant is here to help you!
@@ -361,13 +565,26 @@ with center_col:
             logger.error(f"Agent build error: {e}")
             st.stop()
 
+        # The selected model first, then every provider with a fallback key. DeepSeek cannot see
+        # images and OCR only runs when it is the selected model, so it is no fallback for them.
+        agents_by_provider = {st.session_state.model_choice: agents}
+        for provider, key in st.session_state.fallback_keys.items():
+            if provider == "deepseek" and uploaded_files:
+                continue
+            if key and provider != st.session_state.model_choice:
+                try:
+                    agents_by_provider[provider] = build_agents(key, provider)
+                except Exception as e:
+                    logger.warning(f"Fallback provider {provider} unavailable: {e}")
+        router = ProviderRouter(list(agents_by_provider), hedge=st.session_state.hedge_requests)
+        stream_responses = st.session_state.stream_responses
+
         all_images = process_images(uploaded_files) if uploaded_files else []
         issue_type = classify_issue_type(user_input)
 
-        if st.session_state.model_choice == "deepseek":
-            all_images = []
-
         rag = init_rag() if st.session_state.enable_rag else None
+        if rag and st.session_state.rerank:
+            init_reranker()
 
         st.divider()
         st.header(" Your Personalized Recovery Plan")
@@ -377,22 +594,17 @@ with center_col:
             if not rag or not st.session_state.enable_rag:
                 return "", []
 
-            retrieved = rag.search(query, issue_type=issue_type, k=3)
+            # A few spare candidates so the policy can choose k by relevance
+            candidates = rag.search(query, issue_type=issue_type, k=RAG_POLICY.max_k + 2,
+                                    rerank=st.session_state.rerank)
 
-            if not retrieved:
+            if not candidates:
                 return "", []
 
-            context_text = "\n\n".join([
-                f"【Reference {i + 1}】Source: {item['source']}\nTitle: {item['title']}\nContent: {item['content'][:500]}..."
-                for i, item in enumerate(retrieved)
-            ])
-
-            return context_text, retrieved
+            return RAG_POLICY.build_context(query, candidates)
 
 
-        def safe_run_with_rag(agent, prompt_template, user_input, issue_type, images, agent_name, rag):
-            rag_context, retrieved_items = get_rag_context(rag, user_input, issue_type)
-
+        def build_prompt_with_rag(prompt_template, user_input, issue_type, rag_context):
             if rag_context and st.session_state.enable_rag:
                 prompt = prompt_template.format(
                     user_input=user_input,
@@ -405,24 +617,27 @@ with center_col:
                     issue_type=issue_type,
                     rag_context="(No reference materials available)"
                 )
+            return prompt
+
 
-            try:
-                response = agent.run(input=prompt, images=images).content
-                return response, retrieved_items
-            except ModelProviderError as e:
+        def show_agent_error(placeholder, agent_name, e):
+            # The router tags errors with the provider that failed (possibly a fallback)
+            provider = getattr(e, "provider", st.session_state.model_choice)
+            if isinstance(e, AgentTimeoutError):
+                placeholder.warning(f"{agent_name} took too long to respond and was skipped: {e}")
+                logger.error(f"Agent timeout: {e}")
+            elif isinstance(e, ModelProviderError):
                 if "Insufficient Balance" in str(e) or "quota" in str(e).lower():
-                    st.error(
-                        f" **{st.session_state.model_choice.upper()} account balance is insufficient!**\n\n"
+                    placeholder.error(
+                        f" **{provider.upper()} account balance is insufficient!**\n\n"
                         f"Please recharge or switch to another model."
                     )
                 else:
-                    st.error(f"Model call failed (ModelProviderError): {e}")
+                    placeholder.error(f"{provider.upper()} call failed (ModelProviderError): {e}")
                 logger.error(f"ModelProviderError: {e}")
-                st.stop()
-            except Exception as e:
+            else:
                 logger.error(f"Agent run error: {e}")
-                st.error(f"An exception occurred when generating content: {e}")
-                st.stop()
+                placeholder.error(f"An exception occurred when generating content: {e}")
 
 
         prompt_empathy_template = """YOUR TASK - EMOTIONAL VALIDATION:
@@ -486,53 +701,93 @@ REQUIRED STRUCTURE:
 
 ABSOLUTELY NO generic motivational quotes. Make it deeply personal."""
 
-        all_retrieved = {}
+        sections = [
+            ("empathy", " Emotional Validation & Support", empathy, prompt_empathy_template,
+             "Analyzing your emotional state..."),
+            ("cognitive", " Cognitive Restructuring", cognitive, prompt_cognitive_template,
+             "Identifying thought patterns..."),
+            ("behavioral", " Practical Coping Strategies", behavioral, prompt_behavioral_template,
+             "Creating action plan..."),
+            ("motivational", " Strength & Motivation", motivational, prompt_motivational_template,
+             "Generating encouragement..."),
+        ]
+
+        # The query is the same for every agent, so embed and search it only once per request
+        rag_context, retrieved = get_rag_context(rag, user_input, issue_type)
+
+        responses = {}
+        placeholders = {}
+        agent_names = {}
+        tasks = {}
+
+        # Answers depend on the images too, so inputs with images are never cached
+        response_cache = init_response_cache() if st.session_state.response_cache and not all_images else None
+        input_emb = encode_query(user_input, normalize=True) if response_cache else None
+        cache_scopes = {key: (issue_type, key, st.session_state.model_choice, bool(rag_context))
+                        for key, *_ in sections}
+
+        for role, (key, title, agent, template, waiting_text) in enumerate(sections):
+            st.subheader(title)
+            placeholders[key] = st.empty()
+            placeholders[key].caption(waiting_text)
+            agent_names[key] = agent.name
+
+            if response_cache and not st.session_state.bypass_response_cache:
+                cached = response_cache.lookup(input_emb, cache_scopes[key])
+                if cached:
+                    responses[key] = cached['response']
+                    placeholders[key].markdown(cached['response'])
+                    st.caption(f"Reused the answer to a similar message (similarity {cached['similarity']:.2f})")
+                    continue
 
-        with st.spinner("Analyzing your emotional state..."):
-            st.subheader(" Emotional Validation & Support")
-            resp_empathy, retrieved_empathy = safe_run_with_rag(
-                empathy, prompt_empathy_template, user_input, issue_type,
-                all_images, "Empathy Agent", rag
-            )
-            st.markdown(resp_empathy)
-            all_retrieved['empathy'] = retrieved_empathy
-
-        with st.spinner("Identifying thought patterns..."):
-            st.subheader(" Cognitive Restructuring")
-            resp_cognitive, retrieved_cognitive = safe_run_with_rag(
-                cognitive, prompt_cognitive_template, user_input, issue_type,
-                all_images, "Cognitive Agent", rag
-            )
-            st.markdown(resp_cognitive)
-            all_retrieved['cognitive'] = retrieved_cognitive
-
-        with st.spinner("Creating action plan..."):
-            st.subheader(" Practical Coping Strategies")
-            resp_behavioral, retrieved_behavioral = safe_run_with_rag(
-                behavioral, prompt_behavioral_template, user_input, issue_type,
-                all_images, "Behavioral Agent", rag
-            )
-            st.markdown(resp_behavioral)
-            all_retrieved['behavioral'] = retrieved_behavioral
-
-        with st.spinner("Generating encouragement..."):
-            st.subheader(" Strength & Motivation")
-            resp_motivational, retrieved_motivational = safe_run_with_rag(
-                motivational, prompt_motivational_template, user_input, issue_type,
-                all_images, "Motivational Agent", rag
-            )
-            st.markdown(resp_motivational)
-            all_retrieved['motivational'] = retrieved_motivational
+            prompt = build_prompt_with_rag(template, user_input, issue_type, rag_context)
+
+            def call(provider, role=role, prompt=prompt):
+                agent = agents_by_provider[provider][role]
+                images = [] if provider == "deepseek" else all_images  # DeepSeek has no image input
+                if stream_responses:
+                    return stream_agent_response(agent, prompt, images)
+                return agent.run(input=prompt, images=images).content
+
+            if stream_responses:
+                tasks[key] = lambda call=call: router.stream(call)
+            else:
+                tasks[key] = lambda call=call: router.run(call)
+
+        with st.spinner("Generating your personalized recovery plan..."):
+            for event in run_agents_concurrently(
+                    tasks, timeout=AGENT_TIMEOUT,
+                    max_workers=None if st.session_state.concurrent_agents else 1):
+                key = event.name
+                if event.error is not None:
+                    # Keep whatever was streamed before the failure
+                    responses[key] = event.text
+                    with placeholders[key].container():
+                        if event.text:
+                            st.markdown(event.text)
+                        show_agent_error(st, agent_names[key], event.error)
+                elif event.done:
+                    responses[key] = event.text
+                    placeholders[key].markdown(event.text)
+                    if response_cache and event.text:
+                        response_cache.store(input_emb, cache_scopes[key], user_input, event.text)
+                else:
+                    placeholders[key].markdown(event.text + " ▌")
+
+        if not any(responses.values()):
+            st.stop()
+
+        resp_empathy = responses["empathy"]
+        resp_cognitive = responses["cognitive"]
+        resp_behavioral = responses["behavioral"]
+        resp_motivational = responses["motivational"]
 
-        if st.session_state.enable_rag and rag and any(all_retrieved.values()):
+        if st.session_state.enable_rag and rag and retrieved:
             with st.expander(" Reference Sources (RAG Results)"):
-                for agent_name, items in all_retrieved.items():
-                    if items:
-                        st.markdown(f"**{agent_name} Agent References:**")
-                        for item in items:
-                            st.markdown(f"- **{item['title']}** (Source: {item['source']}, Score: {item['score']:.2f})")
-                            st.caption(f"  Preview: {item['content'][:150]}...")
-                        st.markdown("---")
+                st.markdown("**References shared by all agents:**")
+                for item in retrieved:
+                    st.markdown(f"- **{item['title']}** (Source: {item['source']}, Relevance: {item.get('similarity', item['score']):.2f})")
+                    st.caption(f"  Preview: {item['content'][:150]}...")
 
         combined_response = f"""Emotional Support:{resp_empathy}
 Cognitive Restructuring:{resp_cognitive}
@@ -545,8 +800,9 @@ Motivational Support:{resp_motivational}"""
             "files": [f.name for f in uploaded_files],
             "timestamp": datetime.now().isoformat(),
             "issue_type": issue_type,
-            "rag_enabled": st.session_state.enable_rag
+            "rag_enabled": st.session_state.enable_rag,
+            "session_id": st.session_state.session_id
         }
         st.session_state.history.append(history_entry)
 
-        save_history()
\ No newline at end of file
+        save_history(history_entry)
\ No newline at end of file
@@ -4,7 +4,11 @@ from agno.models.openai import OpenAIChat
 from agno.models.anthropic import Claude
 from agno.models.deepseek import DeepSeek
 from agno.tools.duckduckgo import DuckDuckGoTools
+from collections import OrderedDict
 from typing import Literal
+import hashlib
+import threading
+import time
 
 
 ModelChoice = Literal["gemini", "openai", "claude", "deepseek"]
@@ -17,21 +21,75 @@ MODEL_ID = {
 }
 
 
-def build_agents(api_key: str, choice: ModelChoice):
-    if choice == "gemini":
-        model = Gemini(id=MODEL_ID[choice], api_key=api_key)
-    elif choice == "openai":
-        model = OpenAIChat(id=MODEL_ID[choice], api_key=api_key)
-    elif choice == "claude":
-        model = Claude(id=MODEL_ID[choice], api_key=api_key)
-    elif choice == "deepseek":
-        model = DeepSeek(id=MODEL_ID[choice], api_key=api_key)
-    else:
+MODEL_CLASS = {
+    "gemini": Gemini,
+    "openai": OpenAIChat,
+    "claude": Claude,
+    "deepseek": DeepSeek
+}
+
+
+class ClientCache:
+    """LRU + TTL cache of provider SDK clients per (model choice, API key digest)"""
+
+    def __init__(self, max_entries: int = 16, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clients = OrderedDict()  # (choice, key digest) -> (client, last used)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, api_key: str, choice: ModelChoice):
+        key = (choice, hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, (_, used) in self._clients.items() if now - used > self.ttl]:
+                del self._clients[stale]
+            if key in self._clients:
+                client = self._clients[key][0]
+                self._clients[key] = (client, now)
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+
+        client = build_model(api_key, choice).get_client()  # created by agno, with its defaults
+        with self._lock:
+            client = self._clients.get(key, (client,))[0]  # keep the first one if two raced
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_entries:
+                self._clients.popitem(last=False)
+            self.misses += 1
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+client_cache = ClientCache()
+
+
+def build_model(api_key: str, choice: ModelChoice, client=None):
+    if choice not in MODEL_CLASS:
         raise ValueError("Unknown model choice")
+    model = MODEL_CLASS[choice](id=MODEL_ID[choice], api_key=api_key)
+    if client is not None:
+        # agno models use a preset client instead of creating their own
+        model.client = client
+    return model
+
+
+def build_agents(api_key: str, choice: ModelChoice, cache_clients: bool = True):
+    # Every agent gets its own model instance: agno stores per-run tool and response
+    # settings on the model, so a shared one is not safe when the agents run concurrently.
+    # The models are cheap; the SDK client underneath (and its connection pool) is shared.
+    client = client_cache.get(api_key, choice) if cache_clients else None
 
     # (1) Empathy Agent 
     empathy_agent = Agent(
-        model=model,
+        model=build_model(api_key, choice, client),
         name="Empathy Agent",
         instructions=[
             "You are an empathetic AI that:",
@@ -57,7 +115,7 @@ def build_agents(api_key: str, choice: ModelChoice):
 
     # (2) Cognitive Restructuring Agent 
     cognitive_agent = Agent(
-        model=model,
+        model=build_model(api_key, choice, client),
         name="Cognitive Restructuring Agent",
         instructions=[
             "You are a CBT specialist that:",
@@ -81,7 +139,7 @@ def build_agents(api_key: str, choice: ModelChoice):
 
     # (3) Behavioral Support Agent 
     behavioral_agent = Agent(
-        model=model,
+        model=build_model(api_key, choice, client),
         name="Behavioral Support Agent",
         instructions=[
             "You are a practical coping strategist that:",
@@ -105,7 +163,7 @@ def build_agents(api_key: str, choice: ModelChoice):
 
     # (4) Motivational Agent 
     motivational_agent = Agent(
-        model=model,
+        model=build_model(api_key, choice, client),
         name="Motivational Agent",
         tools=[DuckDuckGoTools()],  # Can search for inspiring resources
         instructions=[
@@ -0,0 +1,100 @@
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional
+
+AGENT_TIMEOUT = 120  # seconds allowed for a single agent once it has started
+
+# Names of the streamed events that carry a content delta (agno 1.x / agno 2.x)
+CONTENT_EVENTS = {"RunResponse", "RunContent"}
+
+
+class AgentTimeoutError(Exception):
+    """Raised (yielded) for an agent that did not finish within its timeout"""
+
+
+class AgentEvent(NamedTuple):
+    name: str
+    text: str  # everything the agent has produced so far
+    done: bool
+    error: Optional[Exception] = None
+
+
+def stream_agent_response(agent, prompt: str, images) -> Iterator[str]:
+    """Yield the text deltas of a streamed agent run"""
+    for chunk in agent.run(input=prompt, images=images, stream=True):
+        event = getattr(chunk, "event", None)
+        if event is not None and getattr(event, "value", event) not in CONTENT_EVENTS:
+            continue
+        if isinstance(chunk.content, str) and chunk.content:
+            yield chunk.content
+
+
+def run_agents_concurrently(tasks: Dict[str, Callable[[], Any]],
+                            timeout: float = AGENT_TIMEOUT,
+                            max_workers: Optional[int] = None) -> Iterator[AgentEvent]:
+    """Run every task (returning text or an iterator of deltas) in a thread pool and yield AgentEvents.
+
+    Each task ends with one done event. timeout counts from the task's start; tasks over it are
+    abandoned. Tasks must not call Streamlit APIs, they run outside the script thread.
+    """
+    if not tasks:
+        return
+
+    events = queue.Queue()
+    started_at = {}
+    cancelled = set()
+
+    def worker(name, fn):
+        started_at[name] = time.monotonic()
+        text = ""
+        try:
+            result = fn()
+            if result is None or isinstance(result, str):
+                events.put(AgentEvent(name, result or "", True))
+                return
+            for delta in result:
+                if name in cancelled:
+                    if hasattr(result, "close"):
+                        result.close()
+                    return
+                text += delta
+                events.put(AgentEvent(name, text, False))
+            events.put(AgentEvent(name, text, True))
+        except Exception as e:
+            events.put(AgentEvent(name, text, True, e))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(tasks), thread_name_prefix="agent")
+    futures = {name: executor.submit(worker, name, fn) for name, fn in tasks.items()}
+    latest_text = {name: "" for name in tasks}
+    remaining = set(tasks)
+
+    try:
+        while remaining:
+            now = time.monotonic()
+            deadlines = [started_at[name] + timeout for name in remaining if name in started_at]
+            wait_for = max(0.0, min(deadlines) - now) if deadlines else timeout
+
+            try:
+                event = events.get(timeout=wait_for)
+            except queue.Empty:
+                event = None
+
+            if event is not None and event.name in remaining:
+                latest_text[event.name] = event.text
+                if event.done:
+                    remaining.discard(event.name)
+                yield event
+
+            now = time.monotonic()
+            expired = [name for name in remaining
+                       if name in started_at and now - started_at[name] >= timeout]
+            for name in expired:
+                cancelled.add(name)
+                futures[name].cancel()
+                remaining.discard(name)
+                yield AgentEvent(name, latest_text[name], True,
+                                 AgentTimeoutError(f"{name} did not finish within {timeout:.0f}s"))
+    finally:
+        cancelled.update(remaining)
+        executor.shutdown(wait=False, cancel_futures=True)
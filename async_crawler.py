@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from crawl_state import CrawlState, content_hash, record_key
+from crawler import KEYWORDS, PsychologyCrawler, parse_baike, parse_psychology_today, parse_zhihu
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+SOURCES = ('zhihu', 'baike', 'psychology_today')
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FetchResult(NamedTuple):
+    body: object
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: str
+
+
+class AsyncPsychologyCrawler:
+    """Concurrent, per-host rate-limited crawler for the PsychologyCrawler sources, incremental with a CrawlState"""
+
+    def __init__(self, base_urls: Optional[Dict[str, str]] = None,
+                 rate_per_host: float = 1.0, burst: int = 2,
+                 max_connections: int = 32, max_connections_per_host: int = 4,
+                 max_retries: int = 3, backoff: float = 0.5, timeout: float = 30,
+                 state: Optional[CrawlState] = None):
+        # Reuse the synchronous crawler's headers and URL builders
+        self.urls = PsychologyCrawler(base_urls)
+        self.headers = self.urls.headers
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.state = state
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate_per_host, self.burst)
+        return self._buckets[host]
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, as_json: bool = False) -> Optional[FetchResult]:
+        """Fetch a page; returns None when the page is unchanged since the previous crawl"""
+        headers = self.state.conditional_headers(url) if self.state else {}
+        for attempt in range(self.max_retries + 1):
+            await self._bucket(url).acquire()
+            retry_after = None
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return None
+                    if response.status not in RETRY_STATUSES:
+                        response.raise_for_status()
+                        text = await response.text()
+                        page_hash = content_hash(text)
+                        previous = self.state.get(url) if self.state else None
+                        if previous and previous['content_hash'] == page_hash:
+                            return None
+                        return FetchResult(json.loads(text) if as_json else text,
+                                           response.headers.get('ETag'),
+                                           response.headers.get('Last-Modified'),
+                                           page_hash)
+                    retry_after = response.headers.get('Retry-After')
+                    error = aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status)
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            logger.warning(f"Retrying {url} in {delay:.1f}s ({error})")
+            await asyncio.sleep(delay)
+
+    async def crawl_page(self, session: aiohttp.ClientSession, url: str,
+                         parse: Callable[[object], List[Dict]], as_json: bool = False) -> List[Dict]:
+        try:
+            page = await self.fetch(session, url, as_json)
+        except Exception as e:
+            if not self.state:
+                raise
+            # Keep the previously crawled records alive rather than tombstoning them on a failed fetch
+            logger.error(f"Failed to fetch {url}, keeping previous records: {e}")
+            page = None
+        if page is None:
+            # Markers carry the record key in 'url', which is what record_key() returns for them
+            return [{'url': child, 'unchanged': True} for child in self.state.children(url)]
+
+        records = parse(page.body)
+        if self.state:
+            self.state.stage(url, page.etag, page.last_modified, page.content_hash,
+                             [record_key(record) for record in records])
+        return records
+
+    async def crawl_zhihu(self, session: aiohttp.ClientSession, keyword: str, pages: int = 5) -> List[Dict]:
+        pages_records = await asyncio.gather(*[
+            self.crawl_page(session, self.urls.zhihu_url(keyword, page), parse_zhihu, as_json=True)
+            for page in range(pages)
+        ])
+        return [record for records in pages_records for record in records]
+
+    async def crawl_baike(self, session: aiohttp.ClientSession, concept: str) -> List[Dict]:
+        url = self.urls.baike_url(concept)
+        return await self.crawl_page(session, url, lambda html: [parse_baike(html, concept, url)])
+
+    async def crawl_psychology_today(self, session: aiohttp.ClientSession, topic: str) -> List[Dict]:
+        url = self.urls.psychology_today_url(topic)
+        return await self.crawl_page(session, url, lambda html: parse_psychology_today(html, url))
+
+    async def crawl_all(self, keywords: Iterable[str] = KEYWORDS, sources: Iterable[str] = SOURCES,
+                        zhihu_pages: int = 5) -> List[Dict]:
+        """Crawl every (source, keyword) pair concurrently; failed pairs are logged and skipped"""
+        self._buckets = {}  # asyncio primitives are bound to the running event loop
+        connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                         limit_per_host=self.max_connections_per_host,
+                                         ttl_dns_cache=300)
+        async with aiohttp.ClientSession(headers=self.headers, connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            jobs = []
+            for source in sources:
+                for keyword in keywords:
+                    if source == 'zhihu':
+                        jobs.append((source, keyword, self.crawl_zhihu(session, keyword, zhihu_pages)))
+                    elif source == 'baike':
+                        jobs.append((source, keyword, self.crawl_baike(session, keyword)))
+                    elif source == 'psychology_today':
+                        jobs.append((source, keyword, self.crawl_psychology_today(session, keyword)))
+                    else:
+                        raise ValueError(f"Unknown source: {source}")
+
+            outcomes = await asyncio.gather(*[job for _, _, job in jobs], return_exceptions=True)
+
+        results = []
+        for (source, keyword, _), outcome in zip(jobs, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Failed to crawl {source} for '{keyword}': {outcome}")
+                continue
+            results.extend(outcome)
+        return results
+
+    def run(self, keywords: Iterable[str] = KEYWORDS, sources: Iterable[str] = SOURCES,
+            zhihu_pages: int = 5) -> List[Dict]:
+        start = time.monotonic()
+        results = asyncio.run(self.crawl_all(keywords, sources, zhihu_pages))
+        logger.info(f"Crawled {len(results)} records in {time.monotonic() - start:.1f}s")
+        return results
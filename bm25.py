@@ -0,0 +1,175 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from document_store import DocumentStore
+
+try:
+    import jieba
+except ImportError:  # jieba is optional; Chinese is indexed as character bigrams instead
+    jieba = None
+
+_CJK_RUN = re.compile(r'[㐀-鿿豈-﫿]+')
+# Latin words and numbers; hyphenated sequences such as "5-4-3-2-1" stay one token
+_WORD = re.compile(r'[a-z0-9]+(?:[-_][a-z0-9]+)*')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS bm25_postings (
+        term TEXT NOT NULL,
+        doc_id INTEGER NOT NULL,
+        tf INTEGER NOT NULL,
+        PRIMARY KEY (term, doc_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS bm25_docs (
+        doc_id INTEGER PRIMARY KEY,
+        length INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS bm25_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        docs INTEGER NOT NULL,
+        total_length INTEGER NOT NULL
+    );
+"""
+
+
+def tokenize(text: str) -> List[str]:
+    """Search terms of text: Latin words plus jieba words (or character bigrams) for Chinese runs"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    tokens = _WORD.findall(_CJK_RUN.sub(' ', text))
+    for run in _CJK_RUN.findall(text):
+        if jieba is not None:
+            tokens.extend(word for word in jieba.lcut_for_search(run) if word.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score(d) = sum(weight / (k + rank)), ranks starting at 1"""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """Okapi BM25 index over the live documents of a DocumentStore, kept in the same database"""
+
+    def __init__(self, store: DocumentStore, k1: float = 1.5, b: float = 0.75):
+        self.store = store
+        self.k1 = k1
+        self.b = b
+        # Committed at once: an open write transaction would lock out every other process
+        with self.store.transaction(commit=True) as conn:
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "INSERT OR IGNORE INTO bm25_stats (id, docs, total_length) "
+                "SELECT 0, COUNT(*), COALESCE(SUM(length), 0) FROM bm25_docs")
+            indexed = self._stats(conn)[0]
+        if indexed != self.store.live_count():
+            # Stores written before the sparse index existed (or migrated from pickle)
+            self.rebuild()
+
+    @staticmethod
+    def _stats(conn) -> Tuple[int, int]:
+        return conn.execute("SELECT docs, total_length FROM bm25_stats WHERE id = 0").fetchone()
+
+    @staticmethod
+    def _forget(conn, ids: Sequence[int]):
+        """Drop the postings of ids and take them out of the stats (inside a store transaction)"""
+        ids = list(ids)
+        removed, removed_length = 0, 0
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            count, length = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM bm25_docs WHERE doc_id IN ({placeholders})",
+                batch).fetchone()
+            removed += count
+            removed_length += length
+            conn.execute(f"DELETE FROM bm25_postings WHERE doc_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM bm25_docs WHERE doc_id IN ({placeholders})", batch)
+        conn.execute("UPDATE bm25_stats SET docs = docs - ?, total_length = total_length - ? WHERE id = 0",
+                                (removed, removed_length))
+
+    def add_many(self, ids: Sequence[int], docs: Sequence[Dict]):
+        postings = []
+        lengths = []
+        for doc_id, doc in zip(ids, docs):
+            terms = Counter(tokenize(f"{doc.get('title', '')} {doc.get('content', '')}"))
+            postings.extend((term, doc_id, tf) for term, tf in terms.items())
+            lengths.append((doc_id, sum(terms.values())))
+        with self.store.transaction() as conn:
+            self._forget(conn, ids)
+            conn.executemany(
+                "INSERT OR REPLACE INTO bm25_postings (term, doc_id, tf) VALUES (?, ?, ?)", postings)
+            conn.executemany("INSERT OR REPLACE INTO bm25_docs (doc_id, length) VALUES (?, ?)", lengths)
+            conn.execute(
+                "UPDATE bm25_stats SET docs = docs + ?, total_length = total_length + ? WHERE id = 0",
+                (len(lengths), sum(length for _, length in lengths)))
+
+    def remove(self, ids: Sequence[int]):
+        """Remove tombstoned documents from the index"""
+        with self.store.transaction() as conn:
+            self._forget(conn, ids)
+
+    def clear(self):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM bm25_postings")
+            conn.execute("DELETE FROM bm25_docs")
+            conn.execute("UPDATE bm25_stats SET docs = 0, total_length = 0 WHERE id = 0")
+
+    def rebuild(self, batch_size: int = 1000):
+        self.clear()
+        batch = []
+        for doc in self.store.iter_all(batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                self.add_many([d['id'] for d in batch], batch)
+                batch = []
+        if batch:
+            self.add_many([d['id'] for d in batch], batch)
+        self.store.commit()
+
+    def search(self, query: str, k: int = 10, allowed_ids: Optional[Iterable[int]] = None,
+               excluded_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """(doc_id, score) of the k best live documents for query, best first"""
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        allowed = set(allowed_ids) if allowed_ids is not None else None
+        excluded = set(excluded_ids or ())
+
+        with self.store.transaction() as conn:
+            total, total_length = self._stats(conn)
+            if not total:
+                return []
+            avg_length = total_length / total
+            postings = {
+                term: conn.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM bm25_postings p "
+                    "JOIN bm25_docs d ON d.doc_id = p.doc_id JOIN documents doc ON doc.id = p.doc_id "
+                    "WHERE p.term = ? AND doc.deleted = 0", (term,)).fetchall()
+                for term in terms
+            }
+
+        scores: Dict[int, float] = {}
+        for term, query_tf in terms.items():
+            rows = postings[term]
+            if not rows:
+                continue
+            idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            for doc_id, tf, length in rows:
+                if (allowed is not None and doc_id not in allowed) or doc_id in excluded:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_tf * idf * tf * (self.k1 + 1) / norm
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,16 +1,58 @@
+import argparse
 import json
+import os
 import re
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
+import time
+from pathlib import Path
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+from chunker import SentenceChunker
+from crawl_state import CrawlState, content_hash, record_key
+from dedup import NearDuplicateFilter
+from issue_classifier import classify_issue_type, GENERAL
+from embedding_service import get_embedding_model, encode, EmbeddingPool, DEFAULT_BATCH_SIZE
+from index_manager import reconstruct_vectors
+from vector_index import VectorIndex
 import faiss
 import numpy as np
 
 
+def iter_records(paths: List[str], start: Tuple[int, int] = (0, -1)) -> Iterator[Tuple[int, int, Dict]]:
+    """Yield (file_index, line, record) from crawled dumps, skipping everything up to start.
+
+    JSON Lines files are streamed one record at a time; legacy .json arrays are still
+    loaded whole.
+    """
+    for file_index, path in enumerate(paths):
+        if file_index < start[0]:
+            continue
+        skip_until = start[1] if file_index == start[0] else -1
+
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                records = enumerate(json.load(f))
+            else:
+                records = ((line, json.loads(text)) for line, text in enumerate(f) if text.strip())
+
+            for line, record in records:
+                if line > skip_until:
+                    yield file_index, line, record
+
+
 class KnowledgeBaseBuilder:
 
     def __init__(self):
-        self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        self.chunk_size = 500
+        self.chunker = SentenceChunker()
+        # MinHash Jaccard and embedding cosine above which a chunk counts as a near-duplicate
+        self.dedup_threshold = 0.8
+        self.embedding_dedup_threshold = 0.95
+
+    def make_dedup_filter(self) -> NearDuplicateFilter:
+        return NearDuplicateFilter(threshold=self.dedup_threshold,
+                                   embedding_threshold=self.embedding_dedup_threshold)
+
+    @property
+    def embedding_model(self):
+        return get_embedding_model()
 
     def clean_text(self, text: str) -> str:
         text = re.sub(r'\s+', ' ', text)
@@ -19,62 +61,283 @@ class KnowledgeBaseBuilder:
             return ""
         return text.strip()
 
+    @staticmethod
+    def normalize_whitespace(text: str) -> str:
+        """Collapse whitespace but keep line breaks and punctuation, which mark sentence boundaries"""
+        text = re.sub(r'[^\S\n]+', ' ', text)
+        return re.sub(r' *\n\s*', '\n', text).strip()
+
     def chunk_text(self, text: str, title: str) -> List[Dict]:
-        chunks = []
-        words = text.split()
-
-        for i in range(0, len(words), self.chunk_size):
-            chunk = ' '.join(words[i:i + self.chunk_size])
-            if chunk:
-                chunks.append({
-                    'title': title,
-                    'content': chunk,
-                    'start_idx': i,
-                    'end_idx': min(i + self.chunk_size, len(words))
-                })
-        return chunks
-
-    def build_from_crawled_data(self, crawled_files: List[str]) -> List[Dict]:
+        """Sentence-aligned chunks within the embedding model's token limit; start_idx/end_idx are character offsets"""
+        return [{
+            'title': title,
+            'content': chunk['content'],
+            'start_idx': chunk['start'],
+            'end_idx': chunk['end']
+        } for chunk in self.chunker.chunk(text)]
+
+    @staticmethod
+    def record_key(item: Dict) -> str:
+        return record_key(item)
+
+    def record_to_chunks(self, item: Dict) -> List[Dict]:
+        clean_content = self.clean_text(item['content'])
+        if not clean_content:
+            return []
+
+        record_hash = content_hash(item['title'] + clean_content)
+        issue_type = self.classify_content(item['title'] + item['content'])
+
+        return [{
+            'title': item['title'],
+            'content': chunk['content'],
+            'source': item.get('source', 'unknown'),
+            'type': item.get('type', 'article'),
+            'url': self.record_key(item),
+            'content_hash': record_hash,
+            'issue_type': issue_type,
+            'start_idx': chunk['start_idx'],
+            'end_idx': chunk['end_idx']
+        } for chunk in self.chunk_text(self.normalize_whitespace(item['content']), item['title'])]
+
+    def build_from_crawled_data(self, crawled_files: List[str], dedup: bool = True) -> List[Dict]:
         knowledge_base = []
+        # Only the shingle pass here: these chunks have not been embedded yet
+        dedup_filter = NearDuplicateFilter(threshold=self.dedup_threshold, embedding_threshold=None) if dedup else None
 
         for file_path in crawled_files:
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
             for item in data:
-                clean_content = self.clean_text(item['content'])
-                if not clean_content:
+                if item.get('unchanged'):
                     continue
-
-                chunks = self.chunk_text(clean_content, item['title'])
-
+                chunks = self.record_to_chunks(item)
+                if dedup_filter:
+                    chunks = dedup_filter.filter(chunks)
                 for chunk in chunks:
-                    knowledge_base.append({
-                        'id': len(knowledge_base),
-                        'title': item['title'],
-                        'content': chunk['content'],
-                        'source': item.get('source', 'unknown'),
-                        'type': item.get('type', 'article'),
-                        'url': item.get('url', ''),
-                        'issue_type': self.classify_content(item['title'] + item['content'])
-                    })
+                    chunk['id'] = len(knowledge_base)
+                    knowledge_base.append(chunk)
 
         return knowledge_base
 
+    def seed_dedup_filter(self, dedup_filter: NearDuplicateFilter, vector_index, batch_size: int = 1000):
+        """Register the live chunks of vector_index with dedup_filter, using their stored vectors"""
+        def flush(batch):
+            dedup_filter.seed(batch)
+            dedup_filter.seed_embeddings(reconstruct_vectors(vector_index.index, [doc['id'] for doc in batch]),
+                                         [doc.get('url') for doc in batch])
+
+        batch = []
+        for doc in vector_index.store.iter_all():
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    def update_index(self, records: Iterable[Dict], vector_index, remove_missing: bool = True,
+                     dedup: bool = True) -> Dict[str, int]:
+        """Apply a crawl to an existing VectorIndex, re-embedding only records whose content hash changed.
+
+        With remove_missing, URLs missing from the crawl are tombstoned; with dedup the filter is
+        seeded from the stored chunks.
+        """
+        known = vector_index.store.url_hashes()
+        seen = set()
+        stats = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'duplicates': 0}
+        dedup_filter = self.make_dedup_filter() if dedup else None
+        if dedup_filter:
+            self.seed_dedup_filter(dedup_filter, vector_index)
+
+        for item in records:
+            key = self.record_key(item)
+            seen.add(key)
+            if item.get('unchanged'):
+                stats['unchanged'] += 1
+                continue
+
+            chunks = self.record_to_chunks(item)
+            new_hash = chunks[0]['content_hash'] if chunks else None
+            if key in known and known[key] == new_hash:
+                stats['unchanged'] += 1
+                continue
+
+            embeddings = None
+            if dedup_filter and chunks:
+                count = len(chunks)
+                chunks = dedup_filter.filter(chunks, owner=key)
+                if chunks:
+                    embeddings = encode([chunk['content'] for chunk in chunks])
+                    chunks, embeddings = dedup_filter.filter_embeddings(chunks, embeddings, owner=key)
+                stats['duplicates'] += count - len(chunks)
+
+            if key in known:
+                stats['updated'] += 1
+            elif chunks:
+                stats['added'] += 1
+            else:
+                continue
+            vector_index.upsert(key, chunks, embeddings=embeddings)
+            known[key] = new_hash
+
+        if remove_missing:
+            missing = [url for url in known if url not in seen]
+            vector_index.remove_urls(missing)
+            stats['removed'] = len(missing)
+
+        vector_index.store.commit()
+        return stats
+
+    def build_streaming(self, crawled_files: List[str], vector_index, index_path: str,
+                        batch_size: int = 256, encode_batch_size: int = DEFAULT_BATCH_SIZE,
+                        checkpoint_every: int = 20, expected_size: Optional[int] = None,
+                        train_sample: int = 50_000, resume: bool = True, workers: int = 1,
+                        dedup: bool = True) -> Dict[str, float]:
+        """Build an index from JSONL dumps in fixed-size batches, checkpointing so a crashed build resumes.
+
+        vector_index should use store_path=f"{index_path}.db". With dedup, memory grows by about 4 KB
+        per kept chunk; use dedup=False for very large corpora.
+        """
+        checkpoint_path = Path(f"{index_path}.checkpoint.json")
+        start = (0, -1)
+        stats = {'records': 0, 'chunks': 0, 'duplicates': 0}
+        dedup_filter = self.make_dedup_filter() if dedup else None
+
+        if resume and checkpoint_path.exists():
+            checkpoint = json.loads(checkpoint_path.read_text(encoding='utf-8'))
+            vector_index.load(index_path, mmap=False)
+            start = (checkpoint['file_index'], checkpoint['line'])
+            stats = {'duplicates': 0, **checkpoint['stats']}
+            if dedup_filter:
+                dedup_filter.seed(vector_index.store.iter_all())
+            print(f"从断点恢复: 文件 {start[0]} 第 {start[1]} 行之后, 已索引 {stats['chunks']} 个片段")
+        else:
+            vector_index.reset()
+
+        run_start = time.monotonic()
+        run_chunks = 0
+        pending: List[Dict] = []
+        position = start
+        batches = 0
+
+        def report(label: str):
+            elapsed = max(time.monotonic() - run_start, 1e-9)
+            print(f"{label}: {stats['records']} 条记录, {stats['chunks']} 个片段, "
+                  f"去重 {stats['duplicates']} 个, {run_chunks / elapsed:.1f} 片段/秒")
+
+        def save_checkpoint():
+            vector_index.save(index_path)
+            tmp_path = checkpoint_path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps({'file_index': position[0], 'line': position[1], 'stats': stats}),
+                                encoding='utf-8')
+            os.replace(tmp_path, checkpoint_path)
+            report("检查点")
+
+        def flush():
+            nonlocal run_chunks, batches
+            chunks = list(pending)
+            incoming = len(chunks)
+            pending.clear()
+            if dedup_filter:
+                chunks = dedup_filter.filter(chunks)
+            if chunks:
+                embeddings = pool.encode([chunk['content'] for chunk in chunks], batch_size=encode_batch_size)
+                if dedup_filter:
+                    chunks, embeddings = dedup_filter.filter_embeddings(chunks, embeddings)
+            if chunks:
+                if expected_size and vector_index.index is None:
+                    vector_index.index_manager.prepare(expected_size, embeddings)
+                vector_index.add_documents(chunks, embeddings=embeddings)
+            stats['duplicates'] += incoming - len(chunks)
+            stats['chunks'] += len(chunks)
+            run_chunks += len(chunks)
+            batches += 1
+            if batches % checkpoint_every == 0:
+                save_checkpoint()
+
+        with EmbeddingPool(workers) as pool:
+            for file_index, line, record in iter_records(crawled_files, start):
+                if not record.get('unchanged'):
+                    pending.extend(self.record_to_chunks(record))
+                    stats['records'] += 1
+                position = (file_index, line)
+
+                # The first flush is larger when it doubles as the training sample
+                threshold = train_sample if expected_size and vector_index.index is None else batch_size
+                if len(pending) >= threshold:
+                    flush()
+
+            if pending:
+                flush()
+        if vector_index.index is not None:
+            vector_index.save(index_path)
+        checkpoint_path.unlink(missing_ok=True)
+
+        elapsed = max(time.monotonic() - run_start, 1e-9)
+        stats['seconds'] = elapsed
+        stats['chunks_per_second'] = run_chunks / elapsed
+        report("构建完成")
+        return stats
+
     def classify_content(self, text: str) -> str:
-        text_lower = text.lower()
-
-        categories = {
-            'breakup': ['分手', '失恋', '前任', 'breakup', 'heartbreak'],
-            'conflict': ['吵架', '冲突', '沟通', 'conflict', 'argument'],
-            'anxiety': ['焦虑', '压力', 'anxiety', 'stress'],
-            'depression': ['抑郁', '情绪低落', 'depression', 'sad'],
-            'work': ['工作', '职场', '绩效', 'work', 'career'],
-            'family': ['家人', '父母', '家庭', 'family', 'parent']
-        }
-
-        for category, keywords in categories.items():
-            if any(kw in text_lower for kw in keywords):
-                return category
-
-        return 'general'
\ No newline at end of file
+        return classify_issue_type(text, default=GENERAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the psychology knowledge-base index from crawled dumps")
+    parser.add_argument('files', nargs='+', help="crawled JSONL dumps (legacy JSON arrays also accepted)")
+    parser.add_argument('--output', default='./knowledge_base/crawled_index', help="index path without suffix")
+    parser.add_argument('--batch-size', type=int,
+                        help="chunks encoded and indexed per batch (default 256, or more with many --workers)")
+    parser.add_argument('--checkpoint-every', type=int, default=20, help="batches between checkpoints")
+    parser.add_argument('--expected-size', type=int, help="expected number of chunks, used to pick the index type")
+    parser.add_argument('--target', choices=['recall', 'balanced', 'latency'], default='balanced')
+    parser.add_argument('--metric', choices=['l2', 'ip'], default='l2', help="ip = cosine over normalized embeddings")
+    parser.add_argument('--quantization', choices=['sq8', 'pq'], help="store compressed vector codes")
+    parser.add_argument('--no-resume', action='store_true', help="ignore an existing checkpoint and start over")
+    parser.add_argument('--workers', type=int, default=1, help="embedding worker processes (1 = encode in-process)")
+    parser.add_argument('--no-dedup', action='store_true', help="index near-duplicate chunks as well")
+    parser.add_argument('--update', action='store_true',
+                        help="apply an incremental crawl to the existing index at --output instead of rebuilding it")
+    parser.add_argument('--keep-missing', action='store_true',
+                        help="with --update, keep documents that do not appear in the crawl")
+    parser.add_argument('--crawl-state', default='./crawled_data/crawl_state.db',
+                        help="crawl state whose staged pages are marked seen once the dump is indexed")
+    args = parser.parse_args()
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    vector_index = VectorIndex(target=args.target, store_path=f"{args.output}.db",
+                               metric=args.metric, quantization=args.quantization)
+    builder = KnowledgeBaseBuilder()
+    if args.update:
+        # A rebuild would drop every record the incremental crawl marked as unchanged
+        vector_index.load(args.output, mmap=False)
+        stats = builder.update_index((record for _, _, record in iter_records(args.files)), vector_index,
+                                     remove_missing=not args.keep_missing, dedup=not args.no_dedup)
+        vector_index.save(args.output)
+        print(f"增量更新完成: 新增 {stats['added']}, 更新 {stats['updated']}, "
+              f"未变 {stats['unchanged']}, 删除 {stats['removed']}, 重复 {stats['duplicates']}")
+    else:
+        # Each worker should get several encode batches per flush
+        batch_size = args.batch_size or max(256, args.workers * DEFAULT_BATCH_SIZE * 4)
+        builder.build_streaming(
+            args.files, vector_index, args.output,
+            batch_size=batch_size,
+            checkpoint_every=args.checkpoint_every,
+            expected_size=args.expected_size,
+            resume=not args.no_resume,
+            workers=args.workers,
+            dedup=not args.no_dedup
+        )
+
+    # Only now are the crawled pages safely in the index
+    if Path(args.crawl_state).exists():
+        state = CrawlState(args.crawl_state)
+        print(f"已确认 {state.commit_pending()} 个抓取页面")
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from embedding_service import get_embedding_model, MODEL_NAME
+
+# MiniLM truncates at 128 tokens including [CLS] and [SEP]
+DEFAULT_MAX_TOKENS = 126
+DEFAULT_OVERLAP_TOKENS = 16
+
+# A sentence ends at Chinese/English terminal punctuation (plus any closing quotes or brackets)
+# or at a line break; an English period only counts when whitespace follows it and it does not
+# close a list number such as "1. "
+_SENTENCE_END = re.compile(r'[。！？!?；;…]+[”’"\'）)\]」』]*|(?<!\d)\.(?=\s)[”’"\'）)\]]*|\n+')
+_CLAUSE_END = re.compile(r'[，,、：:]')
+_CJK = re.compile(r'[㐀-鿿豈-﫿]')
+
+TokenCounter = Callable[[Sequence[str]], List[int]]
+
+_counter_lock = threading.Lock()
+_counters: Dict[str, TokenCounter] = {}
+
+
+def estimate_tokens(texts: Sequence[str]) -> List[int]:
+    """Rough count without a tokenizer: one token per CJK character, 4/3 per other word"""
+    counts = []
+    for text in texts:
+        cjk = len(_CJK.findall(text))
+        words = len(_CJK.sub(' ', text).split())
+        counts.append(cjk + (words * 4 + 2) // 3)
+    return counts
+
+
+def get_token_counter(model_name: str = MODEL_NAME) -> TokenCounter:
+    """Batch token counter backed by the embedding model's own tokenizer"""
+    with _counter_lock:
+        if model_name not in _counters:
+            tokenizer = get_embedding_model(model_name).tokenizer
+
+            def count(texts: Sequence[str]) -> List[int]:
+                if not texts:
+                    return []
+                return [len(ids) for ids in tokenizer(list(texts), add_special_tokens=False)['input_ids']]
+
+            _counters[model_name] = count
+        return _counters[model_name]
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """(start, end) character spans of the sentences of text, whitespace trimmed"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    trimmed = []
+    for start, end in spans:
+        piece = text[start:end]
+        stripped = piece.strip()
+        if stripped:
+            offset = start + piece.index(stripped)
+            trimmed.append((offset, offset + len(stripped)))
+    return trimmed
+
+
+class SentenceChunker:
+    """Split Chinese or English text into overlapping chunks of whole sentences that fit max_tokens"""
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                 count_tokens: Optional[TokenCounter] = None):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        if self._count_tokens is None:
+            self._count_tokens = get_token_counter()
+        return self._count_tokens(texts)
+
+    def _fit(self, text: str, start: int, end: int, tokens: int) -> List[Tuple[int, int, int]]:
+        """Break an over-long span into (start, end, tokens) pieces that fit max_tokens"""
+        if tokens <= self.max_tokens:
+            return [(start, end, tokens)]
+
+        cuts = [m.end() for m in _CLAUSE_END.finditer(text, start, end)]
+        if cuts and cuts[-1] == end:
+            cuts.pop()
+        if not cuts:
+            # No clause punctuation left: cut proportionally by characters
+            pieces = -(-tokens // self.max_tokens)
+            step = -(-(end - start) // pieces)
+            cuts = list(range(start + step, end, step))
+
+        bounds = [start] + cuts + [end]
+        spans = [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+        counts = self.count_tokens([text[a:b] for a, b in spans])
+        fitted = []
+        for (a, b), count in zip(spans, counts):
+            if count > self.max_tokens and b - a > 1:
+                fitted.extend(self._fit(text, a, b, count))
+            else:
+                fitted.append((a, b, count))
+        return fitted
+
+    def chunk(self, text: str) -> List[Dict]:
+        """[{'content', 'start', 'end', 'tokens'}] for text"""
+        if not text or not text.strip():
+            return []
+
+        sentences = split_sentences(text)
+        counts = self.count_tokens([text[start:end] for start, end in sentences])
+        pieces = []
+        for (start, end), count in zip(sentences, counts):
+            pieces.extend(self._fit(text, start, end, count))
+
+        chunks = []
+        current: List[Tuple[int, int, int]] = []
+        current_tokens = 0
+
+        def emit():
+            start, end = current[0][0], current[-1][1]
+            chunks.append({'content': text[start:end], 'start': start, 'end': end, 'tokens': current_tokens})
+
+        for piece in pieces:
+            if current and current_tokens + piece[2] > self.max_tokens:
+                emit()
+                # Carry the trailing pieces that fit in the overlap budget into the next chunk
+                overlap = []
+                overlap_tokens = 0
+                for previous in reversed(current):
+                    if overlap_tokens + previous[2] > self.overlap_tokens or \
+                            overlap_tokens + previous[2] + piece[2] > self.max_tokens:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous[2]
+                current, current_tokens = overlap, overlap_tokens
+            current.append(piece)
+            current_tokens += piece[2]
+
+        if current:
+            emit()
+        return chunks
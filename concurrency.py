@@ -0,0 +1,113 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only cover the threads of one process
+    fcntl = None
+
+
+class FileLock:
+    """Lock file shared by threads and processes (flock; per-process only without fcntl), not reentrant"""
+
+    _process_locks = {}
+    _process_locks_guard = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = str(Path(path).resolve())
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with FileLock._process_locks_guard:
+            self._thread_lock = FileLock._process_locks.setdefault(self.path, threading.Lock())
+        self._file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            try:
+                self._file = open(self.path, 'a')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def atomic_write(path: str, write: Callable[[str], None]):
+    """Call write(tmp_path) and atomically rename the result over path.
+
+    Readers (including other processes) see either the old file or the complete new one,
+    never a partially written file.
+    """
+    path = str(path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class SingleWriter:
+    """Run jobs one at a time in submission order on a dedicated thread, optionally under a FileLock"""
+
+    def __init__(self, name: str = "single-writer", lock_path: Optional[str] = None):
+        self.lock = FileLock(lock_path) if lock_path else None
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self.lock is not None:
+                    with self.lock:
+                        result = fn(*args, **kwargs)
+                else:
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        self._jobs.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Submit and wait for the result (re-raising the job's exception)"""
+        if threading.current_thread() is self._thread:
+            # Already on the writer thread (e.g. a job that commits): run inline
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def close(self):
+        self._jobs.put(None)
+        self._thread.join()
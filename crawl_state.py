@@ -0,0 +1,85 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+def record_key(record: Dict) -> str:
+    """Stable identity of a crawled record: its URL, or source + title when it has none"""
+    return record.get('url') or f"{record.get('source', 'unknown')}:{record.get('title', '')}"
+
+
+class CrawlState:
+    """HTTP validators, content hash and produced record keys per URL from the previous crawl"""
+
+    def __init__(self, path: str = "./crawled_data/crawl_state.db"):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        for table in ('pages', 'pending_pages'):
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    children TEXT,
+                    fetched_at TEXT
+                )""")
+        self.conn.commit()
+
+    def get(self, url: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT etag, last_modified, content_hash, children FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'etag': row[0],
+            'last_modified': row[1],
+            'content_hash': row[2],
+            'children': json.loads(row[3]) if row[3] else []
+        }
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        page = self.get(url)
+        headers = {}
+        if page and page['etag']:
+            headers['If-None-Match'] = page['etag']
+        if page and page['last_modified']:
+            headers['If-Modified-Since'] = page['last_modified']
+        return headers
+
+    def children(self, url: str) -> List[str]:
+        page = self.get(url)
+        return page['children'] if page else []
+
+    def update(self, url: str, etag: Optional[str], last_modified: Optional[str],
+               page_hash: str, children: List[str], table: str = 'pages'):
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {table} (url, etag, last_modified, content_hash, children, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, page_hash, json.dumps(children, ensure_ascii=False),
+             datetime.now().isoformat()))
+        self.conn.commit()
+
+    def stage(self, url: str, etag: Optional[str], last_modified: Optional[str],
+              page_hash: str, children: List[str]):
+        """Record a fetched page without marking it seen: until commit_pending() it is fetched in full"""
+        self.update(url, etag, last_modified, page_hash, children, table='pending_pages')
+
+    def commit_pending(self) -> int:
+        """Mark every staged page as seen (call once its records are indexed)"""
+        with self.conn:
+            count = self.conn.execute("SELECT COUNT(*) FROM pending_pages").fetchone()[0]
+            self.conn.execute("INSERT OR REPLACE INTO pages SELECT * FROM pending_pages")
+            self.conn.execute("DELETE FROM pending_pages")
+        return count
+
+    def close(self):
+        self.conn.close()
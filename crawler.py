@@ -1,63 +1,100 @@
 import requests
 from bs4 import BeautifulSoup
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional
+from urllib.parse import quote, urljoin
 import time
 
+BASE_URLS = {
+    'zhihu': "https://www.zhihu.com",
+    'baike': "https://baike.baidu.com",
+    'psychology_today': "https://www.psychologytoday.com"
+}
+
+
+def parse_zhihu(data: Dict) -> List[Dict]:
+    return [{
+        'source': 'zhihu',
+        'title': item.get('title', ''),
+        'content': item.get('content', ''),
+        'url': item.get('url', ''),
+        'type': 'qa'
+    } for item in data.get('data', [])]
+
+
+def parse_baike(html: str, concept: str, url: str = '') -> Dict:
+    soup = BeautifulSoup(html, 'html.parser')
+    content = soup.find('div', class_='main-content')
+
+    return {
+        'source': 'baike',
+        'title': concept,
+        'content': content.get_text() if content else '',
+        'url': url,
+        'type': 'concept'
+    }
+
+
+def parse_psychology_today(html: str, page_url: str = '') -> List[Dict]:
+    soup = BeautifulSoup(html, 'html.parser')
+
+    articles = []
+    for i, article in enumerate(soup.find_all('article', limit=20)):
+        link = article.find('a', href=True)
+        articles.append({
+            'source': 'psychology_today',
+            'title': article.find('h2').get_text() if article.find('h2') else '',
+            'content': article.find('p').get_text() if article.find('p') else '',
+            'url': urljoin(page_url, link['href']) if link else f"{page_url}#{i}",
+            'type': 'article'
+        })
+    return articles
+
 
 class PsychologyCrawler:
 
-    def __init__(self):
+    def __init__(self, base_urls: Optional[Dict[str, str]] = None):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
+        # Overridable so the crawler can be pointed at a local stub server
+        self.base_urls = {**BASE_URLS, **(base_urls or {})}
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+
+    def zhihu_url(self, keyword: str, page: int) -> str:
+        return f"{self.base_urls['zhihu']}/api/v4/search_v3?q={quote(keyword)}&page={page}"
+
+    def baike_url(self, concept: str) -> str:
+        return f"{self.base_urls['baike']}/item/{quote(concept)}"
+
+    def psychology_today_url(self, topic: str) -> str:
+        return f"{self.base_urls['psychology_today']}/us/search?keys={quote(topic)}"
 
     def crawl_zhihu(self, keyword: str, pages: int = 5) -> List[Dict]:
         results = []
         for page in range(pages):
-            url = f"https://www.zhihu.com/api/v4/search_v3?q={keyword}&page={page}"
-            response = requests.get(url, headers=self.headers)
-            data = response.json()
-
-            for item in data.get('data', []):
-                results.append({
-                    'source': 'zhihu',
-                    'title': item.get('title', ''),
-                    'content': item.get('content', ''),
-                    'url': item.get('url', ''),
-                    'type': 'qa'
-                })
+            response = self.session.get(self.zhihu_url(keyword, page))
+            results.extend(parse_zhihu(response.json()))
             time.sleep(1)
         return results
 
     def crawl_baike(self, concept: str) -> Dict:
-        url = f"https://baike.baidu.com/item/{concept}"
-        response = requests.get(url, headers=self.headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        url = self.baike_url(concept)
+        response = self.session.get(url)
+        return parse_baike(response.text, concept, url)
 
-        content = soup.find('div', class_='main-content')
+    def crawl_psychology_today(self, topic: str) -> List[Dict]:
+        url = self.psychology_today_url(topic)
+        response = self.session.get(url)
+        return parse_psychology_today(response.text, url)
 
-        return {
-            'source': 'baike',
-            'title': concept,
-            'content': content.get_text() if content else '',
-            'type': 'concept'
-        }
 
-    def crawl_psychology_today(self, topic: str) -> List[Dict]:
-        url = f"https://www.psychologytoday.com/us/search?keys={topic}"
-        response = requests.get(url, headers=self.headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        articles = []
-        for article in soup.find_all('article', limit=20):
-            articles.append({
-                'source': 'psychology_today',
-                'title': article.find('h2').get_text() if article.find('h2') else '',
-                'content': article.find('p').get_text() if article.find('p') else '',
-                'type': 'article'
-            })
-        return articles
+def save_records(records: List[Dict], path: str, append: bool = False):
+    """Write crawled records as JSON Lines, the format read by the streaming knowledge-base build"""
+    with open(path, 'a' if append else 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
 
 
 KEYWORDS = [
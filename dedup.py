@@ -0,0 +1,145 @@
+import re
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from embedding_service import EMBEDDING_DIM
+
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """Character n-grams of text with case, width and whitespace normalized away.
+
+    Characters rather than words, so Chinese text without spaces is handled the same way as English.
+    """
+    text = re.sub(r'\s+', '', unicodedata.normalize('NFKC', text).casefold())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures: the fraction of equal slots estimates the Jaccard similarity of two shingle sets"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) & _PRIME for s in shingles(text, self.shingle_size)),
+                             dtype=np.uint64)
+        # Both factors are below 2**31, so the product cannot overflow uint64
+        return ((hashes[:, None] * self.a + self.b) % _PRIME).min(axis=0)
+
+
+class NearDuplicateFilter:
+    """MinHash/LSH (and optional embedding) near-duplicate filter; its state grows by about 4 KB per kept chunk"""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 8, shingle_size: int = 5,
+                 embedding_threshold: Optional[float] = 0.95, dimension: int = EMBEDDING_DIM,
+                 block_size: int = 1024):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.embedding_threshold = embedding_threshold
+        self.block_size = block_size
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._signatures: List[np.ndarray] = []
+        self._owners: List[Optional[str]] = []
+        self._embeddings = None
+        self._embedding_owners: List[Optional[str]] = []
+        if embedding_threshold is not None:
+            # Approximate neighbours are enough here and keep the cost per batch flat as the corpus grows
+            self._embeddings = faiss.IndexHNSWFlat(dimension, 32, faiss.METRIC_INNER_PRODUCT)
+        self.stats = {'minhash': 0, 'embedding': 0}
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add_text(self, text: str, owner: Optional[str] = None) -> bool:
+        """Register text and return True, or return False if it near-duplicates an earlier text"""
+        signature = self.hasher.signature(text)
+        keys = list(self._band_keys(signature))
+
+        candidates = {doc for key in keys for doc in self._buckets.get(key, ())}
+        for doc in candidates:
+            # Text registered under the same owner (record key) is about to be replaced by this one
+            if owner is not None and self._owners[doc] == owner:
+                continue
+            if np.mean(self._signatures[doc] == signature) >= self.threshold:
+                return False
+
+        doc = len(self._signatures)
+        self._signatures.append(signature)
+        self._owners.append(owner)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(doc)
+        return True
+
+    def seed(self, chunks: Iterable[Dict]):
+        """Register chunks that are already indexed (e.g. when resuming a build), owned by their url"""
+        for chunk in chunks:
+            self.add_text(chunk['content'], chunk.get('url'))
+
+    def seed_embeddings(self, embeddings: np.ndarray, owners: List[Optional[str]]):
+        """Register the embeddings of chunks that are already indexed for the embedding pass"""
+        if self._embeddings is None or not len(embeddings):
+            return
+        self._embeddings.add(self._normalized(embeddings))
+        self._embedding_owners.extend(owners)
+
+    def filter(self, chunks: List[Dict], owner: Optional[str] = None) -> List[Dict]:
+        kept = [chunk for chunk in chunks if self.add_text(chunk['content'], owner)]
+        self.stats['minhash'] += len(chunks) - len(kept)
+        return kept
+
+    @staticmethod
+    def _normalized(embeddings: np.ndarray) -> np.ndarray:
+        normed = np.ascontiguousarray(embeddings, dtype='float32').copy()
+        faiss.normalize_L2(normed)
+        return normed
+
+    def filter_embeddings(self, chunks: List[Dict], embeddings: np.ndarray,
+                          owner: Optional[str] = None) -> Tuple[List[Dict], np.ndarray]:
+        """Drop chunks whose embedding is within embedding_threshold cosine of one kept earlier"""
+        if self._embeddings is None or not chunks:
+            return chunks, embeddings
+
+        normed = self._normalized(embeddings)
+        # With an owner, look past a few neighbours that belong to it
+        k = 1 if owner is None else 4
+
+        keep = np.ones(len(chunks), dtype=bool)
+        # Blocks bound the pairwise matrix (block_size^2 floats) however large the batch is;
+        # duplicates across blocks are caught by the index, which holds every earlier kept block
+        for start in range(0, len(chunks), self.block_size):
+            block = normed[start:start + self.block_size]
+            block_keep = keep[start:start + self.block_size]
+            if self._embeddings.ntotal:
+                similarities, neighbours = self._embeddings.search(block, k)
+                for i in range(len(block)):
+                    block_keep[i] &= not any(
+                        neighbour >= 0 and similarity >= self.embedding_threshold
+                        and (owner is None or self._embedding_owners[neighbour] != owner)
+                        for similarity, neighbour in zip(similarities[i], neighbours[i]))
+
+            within = block @ block.T
+            for i in range(len(block)):
+                if block_keep[i]:
+                    block_keep[i + 1:][within[i, i + 1:] >= self.embedding_threshold] = False
+            self._embeddings.add(block[block_keep])
+            self._embedding_owners.extend([owner] * int(block_keep.sum()))
+
+        self.stats['embedding'] += int((~keep).sum())
+        return [chunk for chunk, kept in zip(chunks, keep) if kept], embeddings[keep]
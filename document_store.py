@@ -0,0 +1,192 @@
+import json
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from concurrency import atomic_write
+
+COLUMNS = ('title', 'content', 'source', 'issue_type', 'type', 'url', 'content_hash')
+
+
+class DocumentStore:
+    """SQLite store of knowledge-base chunks keyed by FAISS position; removed chunks are tombstoned"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    title TEXT,
+                    content TEXT,
+                    source TEXT,
+                    issue_type TEXT,
+                    type TEXT,
+                    url TEXT,
+                    content_hash TEXT,
+                    deleted INTEGER NOT NULL DEFAULT 0,
+                    extra TEXT
+                )""")
+            existing = {row[1] for row in self.conn.execute("PRAGMA table_info(documents)")}
+            if 'content_hash' not in existing:
+                self.conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+            if 'deleted' not in existing:
+                self.conn.execute("ALTER TABLE documents ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_issue_type ON documents(issue_type)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_url ON documents(url)")
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        """Number of ids in use, tombstones included (the next free FAISS position)"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def live_count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM documents WHERE deleted = 0").fetchone()[0]
+
+    def add_many(self, docs: List[Dict], start_id: Optional[int] = None) -> List[int]:
+        """Insert docs with consecutive ids (from start_id, default the current size) and return the ids"""
+        with self._lock:
+            if start_id is None:
+                start_id = len(self)
+            rows = []
+            for offset, doc in enumerate(docs):
+                extra = {key: value for key, value in doc.items() if key not in COLUMNS and key != 'id'}
+                rows.append((start_id + offset, *[doc.get(column) for column in COLUMNS],
+                             json.dumps(extra, ensure_ascii=False) if extra else None))
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO documents (id, {', '.join(COLUMNS)}, extra) "
+                f"VALUES ({', '.join('?' * (len(COLUMNS) + 2))})", rows)
+            return [row[0] for row in rows]
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        doc = {'id': row['id']}
+        doc.update({column: row[column] for column in COLUMNS if row[column] is not None})
+        if row['extra']:
+            doc.update(json.loads(row['extra']))
+        return doc
+
+    def get(self, doc_id: int) -> Optional[Dict]:
+        return self.get_many([doc_id])[0]
+
+    def get_many(self, ids: Iterable[int]) -> List[Optional[Dict]]:
+        """Fetch docs by id, in the given order (None for unknown ids)"""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM documents WHERE deleted = 0 AND id IN ({', '.join('?' * len(ids))})",
+                ids).fetchall()
+        by_id = {row['id']: self._to_dict(row) for row in rows}
+        return [by_id.get(i) for i in ids]
+
+    def iter_all(self, batch_size: int = 1000):
+        last_id = -1
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT * FROM documents WHERE deleted = 0 AND id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._to_dict(row)
+            last_id = rows[-1]['id']
+
+    def ids_for_issue_types(self, issue_types: Iterable[str], include_untagged: bool = True) -> List[int]:
+        issue_types = [t for t in issue_types if t]
+        conditions = []
+        if issue_types:
+            conditions.append(f"issue_type IN ({', '.join('?' * len(issue_types))})")
+        if include_untagged:
+            conditions.append("issue_type IS NULL OR issue_type = ''")
+        if not conditions:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id FROM documents WHERE deleted = 0 AND ({' OR '.join(conditions)})",
+                issue_types).fetchall()
+        return [row[0] for row in rows]
+
+    def deleted_ids(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT id FROM documents WHERE deleted = 1")]
+
+    def url_hashes(self) -> Dict[str, str]:
+        """url -> content_hash of the live documents that came from a URL"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT url, content_hash FROM documents WHERE deleted = 0 AND url IS NOT NULL AND url != '' "
+                "GROUP BY url").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def tombstone_urls(self, urls: Iterable[str]) -> List[int]:
+        """Mark every live document of the given URLs as deleted and return their ids"""
+        urls = list(urls)
+        ids = []
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(urls), 500):
+                batch = urls[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                ids.extend(row[0] for row in self.conn.execute(
+                    f"SELECT id FROM documents WHERE deleted = 0 AND url IN ({placeholders})", batch))
+                self.conn.execute(f"UPDATE documents SET deleted = 1 WHERE url IN ({placeholders})", batch)
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM documents")
+
+    @contextmanager
+    def transaction(self, commit: bool = False):
+        """Hold the store lock and yield the connection; with commit=True its writes are committed on exit"""
+        with self._lock:
+            yield self.conn
+            if commit:
+                self.conn.commit()
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def backup_to(self, path: str):
+        """Write a consistent copy of the store to another database file (atomically replaced)"""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        def write(tmp_path: str):
+            target = sqlite3.connect(tmp_path)
+            try:
+                self.conn.backup(target)
+            finally:
+                target.close()
+
+        with self._lock:
+            self.conn.commit()
+            atomic_write(path, write)
+
+    def import_pickle(self, pkl_path: str) -> int:
+        """Migrate a legacy pickled knowledge_base list (ids are its list positions)"""
+        with open(pkl_path, 'rb') as f:
+            knowledge_base = pickle.load(f)
+        with self._lock:
+            self.clear()
+            self.add_many(knowledge_base, start_id=0)
+            self.commit()
+        return len(knowledge_base)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
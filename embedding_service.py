@@ -0,0 +1,258 @@
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from concurrency import atomic_write
+
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+EMBEDDING_DIM = 384
+DEFAULT_BATCH_SIZE = 32
+
+_models: Dict[Tuple[str, str], SentenceTransformer] = {}
+_lock = threading.Lock()
+
+
+def _resolve_device(device: Optional[str]) -> str:
+    return device or ('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def get_embedding_model(model_name: str = MODEL_NAME, device: Optional[str] = None) -> SentenceTransformer:
+    """Return the process-wide SentenceTransformer, loading it on first use"""
+    key = (model_name, _resolve_device(device))
+    with _lock:
+        if key not in _models:
+            _models[key] = SentenceTransformer(model_name, device=key[1])
+        return _models[key]
+
+
+def encode(texts: List[str],
+           batch_size: int = DEFAULT_BATCH_SIZE,
+           normalize: bool = False,
+           num_threads: Optional[int] = None,
+           show_progress_bar: bool = False,
+           model_name: str = MODEL_NAME,
+           device: Optional[str] = None) -> np.ndarray:
+    """Encode texts in batches with the shared model and return a float32 matrix.
+
+    num_threads sets torch's intra-op thread count, which is global to the process.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, EMBEDDING_DIM), dtype='float32')
+
+    embeddings = get_embedding_model(model_name, device).encode(
+        texts,
+        batch_size=batch_size,
+        normalize_embeddings=normalize,
+        show_progress_bar=show_progress_bar,
+        convert_to_numpy=True
+    )
+    return np.ascontiguousarray(embeddings, dtype='float32')
+
+
+class EmbeddingPool:
+    """Shard encoding across worker processes (use as a context manager); small inputs use encode()"""
+
+    def __init__(self, workers: int, model_name: str = MODEL_NAME, threads_per_worker: Optional[int] = None):
+        self.workers = workers
+        self.model_name = model_name
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // max(workers, 1))
+        self._pool = None
+
+    def start(self):
+        if self.workers <= 1 or self._pool is not None:
+            return self
+        # Worker processes inherit the environment, so this caps their torch/OpenMP threads
+        previous = os.environ.get('OMP_NUM_THREADS')
+        os.environ['OMP_NUM_THREADS'] = str(self.threads_per_worker)
+        try:
+            model = get_embedding_model(self.model_name, 'cpu')
+            self._pool = model.start_multi_process_pool(target_devices=['cpu'] * self.workers)
+        finally:
+            if previous is None:
+                os.environ.pop('OMP_NUM_THREADS', None)
+            else:
+                os.environ['OMP_NUM_THREADS'] = previous
+        return self
+
+    def encode(self, texts: List[str], batch_size: int = DEFAULT_BATCH_SIZE, normalize: bool = False) -> np.ndarray:
+        texts = list(texts)
+        if self._pool is None or len(texts) < 2 * batch_size:
+            # Not even two encode batches: too little work to be worth shipping to the pool
+            return encode(texts, batch_size=batch_size, normalize=normalize, model_name=self.model_name)
+        # One shard per worker, but never less than one encode batch (so at most len // batch_size shards)
+        shards = min(self.workers, len(texts) // batch_size)
+        embeddings = get_embedding_model(self.model_name, 'cpu').encode_multi_process(
+            texts, self._pool, batch_size=batch_size, normalize_embeddings=normalize,
+            chunk_size=-(-len(texts) // shards))
+        return np.ascontiguousarray(embeddings, dtype='float32')
+
+    def close(self):
+        if self._pool is not None:
+            get_embedding_model(self.model_name, 'cpu').stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class QueryEmbeddingCache:
+    """LRU + TTL cache of normalized query embeddings with an optional bounded on-disk tier"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 24 * 3600, disk_dir: Optional[str] = None,
+                 max_disk_entries: int = 20_000, prune_every: int = 500):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.prune_every = prune_every
+        self._disk_writes = 0
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+    def set_disk_dir(self, disk_dir: Optional[str]):
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Delete expired disk entries and the oldest ones beyond max_disk_entries"""
+        if not self.disk_dir:
+            return
+        now = time.time()
+        files = []
+        for path in self.disk_dir.glob('*.npy'):
+            try:
+                mtime = path.stat().st_mtime
+                if now - mtime > self.ttl:
+                    path.unlink()
+                else:
+                    files.append((mtime, path))
+            except OSError:
+                pass
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_disk_entries)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.npy"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, vector = entry
+                if now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector.copy()
+                del self._entries[key]
+                self.evictions += 1
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                if now - path.stat().st_mtime <= self.ttl:
+                    vector = np.load(path).astype('float32')
+                    self._put_memory(key, vector, path.stat().st_mtime)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return vector.copy()
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, EOFError):
+                # Unreadable entry (e.g. left by an older non-atomic write): drop it
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_memory(self, key: str, vector: np.ndarray, created: float):
+        with self._lock:
+            self._entries[key] = (created, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key: str, vector: np.ndarray):
+        vector = np.ascontiguousarray(vector, dtype='float32')
+        self._put_memory(key, vector, time.time())
+        if self.disk_dir:
+            try:
+                atomic_write(self._disk_path(key), lambda tmp_path: _save_npy(tmp_path, vector))
+            except OSError:
+                return
+            with self._lock:
+                self._disk_writes += 1
+                prune = self._disk_writes % self.prune_every == 0
+            if prune:
+                self.prune_disk()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+
+def _save_npy(path: str, vector: np.ndarray):
+    # Through a file object: np.save would append .npy to the temporary file name
+    with open(path, 'wb') as f:
+        np.save(f, vector)
+
+
+query_cache = QueryEmbeddingCache()
+
+
+def encode_query(query: str, normalize: bool = False, model_name: str = MODEL_NAME) -> np.ndarray:
+    """Encode a single search query as a (1, dim) float32 matrix, served from query_cache when possible"""
+    key = f"{model_name}|{int(normalize)}|{QueryEmbeddingCache.normalize(query)}"
+    vector = query_cache.get(key)
+    if vector is None:
+        vector = encode([query], normalize=normalize, model_name=model_name)[0]
+        query_cache.put(key, vector)
+    return vector.reshape(1, -1)
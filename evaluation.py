@@ -3,7 +3,9 @@ from pathlib import Path
 from typing import List, Dict, Any
 import numpy as np
 import torch
-from sentence_transformers import SentenceTransformer, util
+from embedding_service import get_embedding_model, encode, MODEL_NAME
+from issue_classifier import classify_issue_type, classify_batch, ISSUE_KEYWORDS, DEFAULT_ISSUE_TYPE
+from history_store import HistoryStore, HISTORY_PATH
 from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime
 
@@ -76,10 +78,9 @@ class OfflineEvaluator:
         ]
 
     def _load_model(self):
-        """Load lightweight multilingual models"""
-        model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
-        logger.info(f"Loading the model: {model_name}")
-        return SentenceTransformer(model_name, device=self.device)
+        """Load lightweight multilingual models (shared with the rest of the process)"""
+        logger.info(f"Loading the model: {MODEL_NAME}")
+        return get_embedding_model(MODEL_NAME, device=self.device)
 
     def _init_anomaly_rules(self) -> Dict[str, List[str]]:
         """Anomaly detection rule library"""
@@ -91,36 +92,7 @@ class OfflineEvaluator:
 
     def classify_issue_type(self, text: str) -> str:
         """Intelligently identify the types of users' emotional problems"""
-        text_lower = text.lower() if text else ""
-
-        if any(kw in text_lower for kw in
-               ["分手", "失恋", "前任", "ex", "离婚", "breakup", "heartbreak", "divorce"]):
-            return "romantic breakup"
-        elif any(kw in text_lower for kw in ["吵架", "争吵", "冲突", "矛盾", "绝交", "误会", "朋友", "室友", "fight",
-                                             "argument", "conflict", "quarrel", "contradiction", "break off relations",
-                                             "misunderstanding", "friends", "roommate"]):
-            return "interpersonal conflict"
-        elif any(kw in text_lower for kw in
-                 ["工作", "职场", "老板", "同事", "绩效", "加班", "kpi", "裁员", "work", "job", "career",
-                  "workplace", "boss", "colleague", "performance", "overtime", "layoffs"]):
-            return "workplace stress"
-        elif any(kw in text_lower for kw in
-                 ["焦虑", "抑郁", "压力", "失眠", "情绪", "心理", "难受", "anxiety", "depressed", "stress",
-                  "insomnia", "emotion", "psychology", "discomfort"]):
-            return "mental health"
-        elif any(kw in text_lower for kw in
-                 ["家人", "家庭", "父母", "亲戚", "沟通", "代沟", "family", "parents", "relatives",
-                  "communication", "generation gap"]):
-            return "family issues"
-        elif any(kw in text_lower for kw in
-                 ["钱", "经济", "贫穷", "债务", "买不起", "money", "economy", "poverty", "debt", "unaffordable"]):
-            return "financial stress"
-        elif any(kw in text_lower for kw in
-                 ["考试", "挂科", "学习", "学业", "论文", "毕业", "gpa", "成绩", "exam", "fail", "study",
-                  "academic performance", "thesis", "graduation", "gpa", "grade"]):
-            return "academic anxiety"
-        else:
-            return "general emotional distress"
+        return classify_issue_type(text)
 
     def preprocess(self, text: str) -> str:
         """Fast preprocessing"""
@@ -131,7 +103,7 @@ class OfflineEvaluator:
     def get_embedding(self, texts: List[str]) -> np.ndarray:
         """Obtain semantic vectors"""
         processed = [self.preprocess(t) for t in texts]
-        return self.model.encode(processed, convert_to_tensor=True, device=self.device).cpu().numpy()
+        return encode(processed, device=self.device)
 
     def detect_emotion(self, text: str) -> str:
         """Enhanced Emotion Detection: Supports a wider range of empathetic expressions"""
@@ -197,14 +169,11 @@ class OfflineEvaluator:
             "我能感受到你", "理解你的", "听到你", "感受到你的", "我看到你", "你现在的情绪", "你的感受"
         ]
 
-        for ui, resp in zip(user_inputs, responses):
-            user_type = self.classify_issue_type(ui)
-            resp_lower = resp.lower()
-
+        user_types = classify_batch(user_inputs)
+        resp_types = classify_batch(responses)
+        for user_type, resp_type, resp in zip(user_types, resp_types, responses):
             # Emotional problem type matching
-            agent_type_match = False
-            if user_type == self.classify_issue_type(resp):
-                agent_type_match = True
+            agent_type_match = user_type == resp_type
 
             # Empathetic expression matching
             empathy_match = any(marker in resp for marker in empathy_markers)
@@ -231,29 +200,10 @@ class OfflineEvaluator:
         anomaly_rate = anomalies / len(responses)
 
         # 5. Scene coverage rate
-        # Simplified Version: Count the coverage of different input types
-        issues = set()
-        for ui in user_inputs:
-            if any(k in ui for k in ["分手", "失恋", "ex", "heartbreak"]):
-                issues.add("breakup")
-            elif any(k in ui for k in ["吵架", "冲突", "绝交", "argument", "conflict"]):
-                issues.add("conflict")
-            elif any(k in ui for k in ["工作", "职场", "绩效", "work", "job", "career"]):
-                issues.add("work")
-            elif any(k in ui for k in ["考试", "挂科", "学业", "exam", "academic"]):
-                issues.add("academic")
-            elif any(k in ui for k in ["家人", "父母", "family", "parents"]):
-                issues.add("family")
-            elif any(k in ui for k in ["钱", "经济", "债务", "money", "debt"]):
-                issues.add("financial")
-            elif any(k in ui for k in ["焦虑", "抑郁", "stress", "anxiety"]):
-                issues.add("mental")
-            else:
-                issues.add("general")
-        total_possible_scenarios = min(7, len(set(
-            [self.classify_issue_type(ui) for ui in user_inputs]
-        )))
-        coverage = len(issues) / max(total_possible_scenarios, 1)
+        # Share of the specific issue types (same classifier as the UI) that the conversations
+        # touched; the default category is not a scenario of its own
+        issues = set(user_types) - {DEFAULT_ISSUE_TYPE}
+        coverage = len(issues) / len(ISSUE_KEYWORDS)
 
         return {
             "语义相似度": float(avg_sim),
@@ -315,13 +265,13 @@ Improvement suggestions
         return report
 
 
-def run_evaluation(history_file: str = "conversation_history.json", output_dir: str = "evaluation_logs"):
+def run_evaluation(history_file: str = HISTORY_PATH, output_dir: str = "evaluation_logs"):
     """Main evaluation process"""
     try:
-        data = json.loads(Path(history_file).read_text(encoding='utf-8'))
+        data = HistoryStore(history_file).tail(50)
         conversations = [
             {"user_input": item["input"], "agent_response": item["response"]}
-            for item in data[-50:]
+            for item in data
             if item.get("response") and item.get("input")
         ]
         if not conversations:
@@ -0,0 +1,240 @@
+import bisect
+import hashlib
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from concurrency import FileLock
+
+HISTORY_PATH = "conversation_history.jsonl"
+LEGACY_HISTORY_PATH = "conversation_history.json"
+
+# Index file header, followed by one record per entry: byte offset, byte length,
+# timestamp (epoch seconds), issue-type code, session_id hash
+_HEADER = b'HISTIDX2'
+_RECORD = struct.Struct('<QIdHQ')
+_UNKNOWN_ISSUE = 0xFFFF
+# Codes are stored in index files: never renumber an issue type, only add new ones
+_ISSUE_CODES = {
+    "romantic breakup": 0,
+    "interpersonal conflict": 1,
+    "workplace stress": 2,
+    "mental health": 3,
+    "family issues": 4,
+    "financial stress": 5,
+    "academic anxiety": 6,
+    "general emotional distress": 7,
+}
+
+
+def _session_hash(session_id: Optional[str]) -> int:
+    if not session_id:
+        return 0
+    return int.from_bytes(hashlib.blake2b(session_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _timestamp(entry: Dict) -> float:
+    try:
+        return datetime.fromisoformat(entry['timestamp']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+class HistoryStore:
+    """Append-only JSONL conversation history with an offset index, shared across sessions and processes"""
+
+    def __init__(self, path: str = HISTORY_PATH, legacy_path: Optional[str] = LEGACY_HISTORY_PATH):
+        self.path = Path(path)
+        self.index_path = Path(f"{path}.idx")
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(f"{path}.lock")
+        self._offsets: List[int] = []
+        self._lengths: List[int] = []
+        self._timestamps: List[float] = []
+        self._chronological = True
+        self._issue_codes: List[int] = []
+        self._sessions: List[int] = []
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if legacy_path:
+            legacy_path = self.path.parent / legacy_path
+        with self._lock, self._file_lock:
+            self.path.touch(exist_ok=True)
+            self._sync(repair=True)
+            # Renamed once imported, so this runs once even if entries were appended already
+            if legacy_path and legacy_path.exists():
+                self._import_json_locked(str(legacy_path))
+
+    def _reset(self):
+        self._offsets, self._lengths, self._timestamps = [], [], []
+        self._issue_codes, self._sessions = [], []
+        self._chronological = True
+
+    def _sync(self, repair: bool = False):
+        """Load index records appended since the last sync (possibly by other processes).
+
+        With repair (the file lock must be held) a torn index record is dropped and data lines
+        that were never indexed are indexed.
+        """
+        known = len(_HEADER) + len(self._offsets) * _RECORD.size
+        if self.index_path.exists():
+            with open(self.index_path, 'rb') as f:
+                header = f.read(len(_HEADER))
+                f.seek(known)
+                data = f.read()
+            if header != _HEADER:
+                # Written by an older version (or torn before its header): rebuilt below
+                if not repair:
+                    return
+                self.index_path.unlink()
+                data = b''
+            usable = len(data) - len(data) % _RECORD.size
+            for record in _RECORD.iter_unpack(data[:usable]):
+                self._remember(*record)
+            if repair and usable != len(data):
+                # A torn write at the end of the index: drop the partial record
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(known + usable)
+        if not repair:
+            return
+
+        # Index any lines appended after the last indexed entry (or the whole file if no index)
+        indexed_end = self._offsets[-1] + self._lengths[-1] if self._offsets else 0
+        if indexed_end > self.path.stat().st_size or not self.index_path.exists():
+            self._reset()
+            self.index_path.unlink(missing_ok=True)
+            indexed_end = 0
+        if indexed_end < self.path.stat().st_size:
+            self._reindex_from(indexed_end)
+
+    def _reindex_from(self, start: int):
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if line.endswith(b'\n') and line.strip():
+                    entry = json.loads(line)
+                    records.append(self._record(offset, len(line), entry))
+                offset += len(line)
+        self._write_records(records)
+
+    def _write_records(self, records: List[tuple]):
+        with open(self.index_path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(_HEADER)
+            f.write(b''.join(_RECORD.pack(*record) for record in records))
+        for record in records:
+            self._remember(*record)
+
+    @staticmethod
+    def _record(offset: int, length: int, entry: Dict):
+        return (offset, length, _timestamp(entry), _ISSUE_CODES.get(entry.get('issue_type'), _UNKNOWN_ISSUE),
+                _session_hash(entry.get('session_id')))
+
+    def _remember(self, offset: int, length: int, timestamp: float, code: int, session: int):
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        if self._timestamps and timestamp < self._timestamps[-1]:
+            self._chronological = False
+        self._timestamps.append(timestamp)
+        self._issue_codes.append(code)
+        self._sessions.append(session)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._offsets)
+
+    def append(self, entry: Dict) -> int:
+        """Append one entry and return its position"""
+        return self.append_many([entry])[0]
+
+    def append_many(self, entries: List[Dict]) -> List[int]:
+        with self._lock, self._file_lock:
+            self._sync(repair=True)
+            return self._append_locked(entries)
+
+    def _append_locked(self, entries: List[Dict]) -> List[int]:
+        lines = [(json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8') for entry in entries]
+        with self._lock:
+            records = []
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                for entry, line in zip(entries, lines):
+                    records.append(self._record(offset, len(line), entry))
+                    offset += len(line)
+                f.write(b''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            # The data is durable before it is indexed; a crash in between is repaired on the next open
+            first = len(self._offsets)
+            self._write_records(records)
+            return list(range(first, len(self._offsets)))
+
+    def _read(self, positions: List[int]) -> List[Dict]:
+        entries = []
+        with open(self.path, 'rb') as f:
+            for position in positions:
+                f.seek(self._offsets[position])
+                entries.append(json.loads(f.read(self._lengths[position])))
+        return entries
+
+    def get(self, position: int) -> Dict:
+        with self._lock:
+            return self._read([range(len(self))[position]])[0]
+
+    def tail(self, n: int) -> List[Dict]:
+        """The last n entries, oldest first"""
+        with self._lock:
+            total = len(self)
+            return self._read(list(range(max(0, total - n), total)))
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              issue_type: Optional[str] = None, session_id: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        """Entries with start <= timestamp < end (and the given issue_type and session_id), oldest first"""
+        with self._lock:
+            self._sync()
+            if self._chronological:
+                lo = bisect.bisect_left(self._timestamps, start.timestamp()) if start else 0
+                hi = bisect.bisect_left(self._timestamps, end.timestamp()) if end else len(self)
+                positions = range(lo, hi)
+            else:
+                low = start.timestamp() if start else float('-inf')
+                high = end.timestamp() if end else float('inf')
+                positions = [p for p, t in enumerate(self._timestamps) if low <= t < high]
+            if issue_type is not None:
+                code = _ISSUE_CODES.get(issue_type, _UNKNOWN_ISSUE)
+                positions = [p for p in positions if self._issue_codes[p] == code]
+            if session_id is not None:
+                session = _session_hash(session_id)
+                positions = [p for p in positions if self._sessions[p] == session]
+            if issue_type is None or issue_type in _ISSUE_CODES:
+                return self._read(list(positions)[:limit] if limit else list(positions))
+            # Unknown issue types share one code, so check the entries themselves before the limit
+            entries = [e for e in self._read(list(positions)) if e.get('issue_type') == issue_type]
+        return entries[:limit] if limit else entries
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def import_json(self, json_path: str) -> int:
+        """Append the entries of a legacy JSON-list history file, then rename it to *.migrated"""
+        with self._lock, self._file_lock:
+            self._sync(repair=True)
+            return self._import_json_locked(json_path)
+
+    def _import_json_locked(self, json_path: str) -> int:
+        entries = json.loads(Path(json_path).read_text(encoding='utf-8'))
+        self._append_locked(entries)
+        os.replace(json_path, f"{json_path}.migrated")
+        return len(entries)
+
@@ -0,0 +1,273 @@
+import faiss
+import math
+import numpy as np
+from concurrency import atomic_write
+from embedding_service import EMBEDDING_DIM
+from typing import Iterable, Optional, Tuple
+
+INDEX_FLAT = "flat"
+INDEX_IVF = "ivf"
+INDEX_HNSW = "hnsw"
+INDEX_IVFPQ = "ivfpq"
+
+METRIC_L2 = "l2"
+METRIC_IP = "ip"  # inner product over L2-normalized vectors, i.e. cosine similarity
+
+QUANT_SQ8 = "sq8"  # int8 scalar quantization, 4x smaller than float32
+QUANT_PQ = "pq"  # product quantization, pq_m bytes per vector
+PQ_MIN_TRAIN = 256  # PQ trains 256 centroids per sub-quantizer
+
+# Corpus sizes at which each target moves to the next index type
+SIZE_THRESHOLDS = {
+    "recall": [(50_000, INDEX_FLAT), (2_000_000, INDEX_HNSW)],
+    "balanced": [(10_000, INDEX_FLAT), (1_000_000, INDEX_IVF)],
+    "latency": [(5_000, INDEX_FLAT), (200_000, INDEX_HNSW)],
+}
+LARGEST_INDEX = {"recall": INDEX_IVF, "balanced": INDEX_IVFPQ, "latency": INDEX_IVFPQ}
+
+
+def choose_index_type(n: int, target: str = "balanced") -> str:
+    """Pick an index type for a corpus of n vectors and a latency-vs-recall target"""
+    if target not in SIZE_THRESHOLDS:
+        raise ValueError(f"Unknown index target: {target}")
+    for limit, index_type in SIZE_THRESHOLDS[target]:
+        if n < limit:
+            return index_type
+    return LARGEST_INDEX[target]
+
+
+def index_type_of(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return INDEX_HNSW
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return INDEX_FLAT
+    return INDEX_IVFPQ if isinstance(ivf, faiss.IndexIVFPQ) else INDEX_IVF
+
+
+def codes_of(index) -> Optional[str]:
+    """Quantization of the stored vectors: QUANT_SQ8, QUANT_PQ, or None for float32"""
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    index = faiss.try_extract_index_ivf(index) or index
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return QUANT_PQ
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return QUANT_SQ8
+    return None
+
+
+def write_index_atomic(index, path: str):
+    """Write a FAISS index through a temporary file, so readers never load a half-written index"""
+    atomic_write(path, lambda tmp_path: faiss.write_index(index, tmp_path))
+
+
+def similarity_score(index, distance: float) -> float:
+    """Relevance score of a search result: cosine for inner-product indexes, 1 / (1 + L2) otherwise"""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return float(distance)
+    return float(1 / (1 + distance))
+
+
+def reconstruct_vectors(index, ids: Iterable[int]) -> np.ndarray:
+    """The stored vectors of ids (approximate for quantized codes).
+
+    IVF indexes get a direct map on first use, which add() then maintains.
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return np.zeros((0, index.d), dtype='float32')
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.no():
+        ivf.make_direct_map()
+    return np.vstack([index.reconstruct(i) for i in ids])
+
+
+def cosine_similarities(index, query_emb: np.ndarray, ids: Iterable[int]) -> np.ndarray:
+    """Cosine similarity between query_emb and the stored vectors of ids, for either metric.
+
+    The vectors are reconstructed from the index, so nothing is re-encoded.
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return np.zeros(0, dtype='float32')
+    vectors = reconstruct_vectors(index, ids)
+    query = np.asarray(query_emb, dtype='float32').reshape(-1)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+    return vectors @ query / np.where(norms == 0, 1.0, norms)
+
+
+def filtered_search(index, query_emb: np.ndarray, k: int,
+                    allowed_ids: Optional[Iterable[int]] = None,
+                    excluded_ids: Optional[Iterable[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k search computed only over allowed_ids (all vectors when None) using a FAISS IDSelector.
+
+    excluded_ids (e.g. tombstoned documents) are skipped when no allow-list is given.
+    For IVF indexes nprobe is widened in proportion to how selective the filter is, so a rare
+    issue_type still gets about as many eligible candidates as an unfiltered search would.
+    Queries against an inner-product index are L2-normalized, matching IndexManager.
+    """
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        query_emb = np.array(query_emb, dtype='float32')
+        faiss.normalize_L2(query_emb)
+    excluded = np.unique(np.asarray(list(excluded_ids or []), dtype='int64'))
+    if allowed_ids is None and len(excluded) == 0:
+        return index.search(query_emb, min(k, index.ntotal))
+
+    if allowed_ids is None:
+        excluded_selector = faiss.IDSelectorBatch(excluded)  # must outlive the search below
+        selector = faiss.IDSelectorNot(excluded_selector)
+        eligible = index.ntotal - len(excluded)
+    else:
+        allowed = np.unique(np.asarray(list(allowed_ids), dtype='int64'))
+        selector = faiss.IDSelectorBatch(allowed)
+        eligible = len(allowed)
+    if eligible <= 0 or k <= 0:
+        return np.zeros((1, 0), dtype='float32'), np.zeros((1, 0), dtype='int64')
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        nprobe = min(ivf.nlist, math.ceil(ivf.nprobe * index.ntotal / eligible))
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(index.hnsw.efSearch, k))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+
+    return index.search(query_emb, min(k, eligible), params=params)
+
+
+class IndexManager:
+    """Owns a FAISS index and rebuilds it with a fitting type as the corpus grows"""
+
+    def __init__(self, dimension: int = EMBEDDING_DIM, target: str = "balanced",
+                 nprobe: Optional[int] = None, ef_search: int = 64, retrain_growth: float = 2.0,
+                 metric: str = METRIC_L2, quantization: Optional[str] = None, pq_m: int = 48):
+        if metric not in (METRIC_L2, METRIC_IP):
+            raise ValueError(f"Unknown metric: {metric}")
+        if quantization not in (None, QUANT_SQ8, QUANT_PQ):
+            raise ValueError(f"Unknown quantization: {quantization}")
+        if quantization == QUANT_PQ and dimension % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) must divide the dimension ({dimension})")
+        self.dimension = dimension
+        self.metric = metric
+        self.quantization = quantization
+        self.pq_m = pq_m
+        self.target = target
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.retrain_growth = retrain_growth
+        self.index = None
+        self.trained_size = 0
+
+    @property
+    def index_type(self) -> Optional[str]:
+        return index_type_of(self.index) if self.index is not None else None
+
+    @property
+    def faiss_metric(self) -> int:
+        return faiss.METRIC_INNER_PRODUCT if self.metric == METRIC_IP else faiss.METRIC_L2
+
+    def _codes(self, index_type: str, train_points: int) -> str:
+        """index_factory name of the vector encoding"""
+        quantization = self.quantization
+        # PQ only inside IVF: a bare IndexPQ rejects the ID selectors of filtered_search
+        if quantization == QUANT_PQ and (index_type in (INDEX_FLAT, INDEX_HNSW) or train_points < PQ_MIN_TRAIN):
+            quantization = QUANT_SQ8
+        if quantization == QUANT_SQ8:
+            return "SQ8"
+        if quantization == QUANT_PQ:
+            return f"PQ{self.pq_m}"
+        return "PQ16" if index_type == INDEX_IVFPQ else "Flat"
+
+    def create(self, n: int, train_size: Optional[int] = None):
+        """Create an empty (untrained) index suited to n vectors, trained later on train_size vectors"""
+        index_type = choose_index_type(n, self.target)
+        codes = self._codes(index_type, train_size or n)
+        if index_type == INDEX_FLAT:
+            return faiss.index_factory(self.dimension, codes, self.faiss_metric)
+        if index_type == INDEX_HNSW:
+            index = faiss.index_factory(self.dimension, "HNSW32" if codes == "Flat" else f"HNSW32,{codes}",
+                                        self.faiss_metric)
+            index.hnsw.efConstruction = 80
+            return index
+
+        # Roughly 4 * sqrt(n) lists, keeping at least 39 training points per centroid
+        nlist = max(1, min(int(4 * math.sqrt(n)), (train_size or n) // 39, 65536))
+        return faiss.index_factory(self.dimension, f"IVF{nlist},{codes}", self.faiss_metric)
+
+    def _vectors(self, embeddings: np.ndarray) -> np.ndarray:
+        """float32 copy of embeddings, L2-normalized for the inner-product metric"""
+        vectors = np.array(embeddings, dtype='float32')
+        if self.metric == METRIC_IP:
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def attach(self, index, trained_size: Optional[int] = None):
+        """Adopt an existing (e.g. loaded) index"""
+        self.index = index
+        self.metric = METRIC_IP if index.metric_type == faiss.METRIC_INNER_PRODUCT else METRIC_L2
+        self.trained_size = index.ntotal if trained_size is None else trained_size
+        self.set_search_params(self.nprobe, self.ef_search)
+        return index
+
+    def prepare(self, expected_size: int, sample: np.ndarray):
+        """Create an empty index sized for expected_size vectors and train it on a sample.
+
+        Used by streaming builds, which cannot hold the whole corpus in memory: vectors are then
+        added batch by batch without a rebuild until the corpus outgrows expected_size.
+        """
+        index = self.create(expected_size, train_size=len(sample))
+        if not index.is_trained:
+            index.train(self._vectors(sample))
+        return self.attach(index, trained_size=expected_size)
+
+    def build(self, embeddings: np.ndarray):
+        """Create, train and fill a new index from scratch"""
+        embeddings = self._vectors(embeddings)
+        index = self.create(len(embeddings))
+        if not index.is_trained:
+            index.train(embeddings)
+        index.add(embeddings)
+        return self.attach(index)
+
+    def add(self, embeddings: np.ndarray):
+        embeddings = self._vectors(embeddings)
+        if self.index is None or not self.index.is_trained:
+            return self.build(embeddings)
+
+        self.index.add(embeddings)
+        if self.needs_rebuild():
+            self.rebuild()
+        return self.index
+
+    def needs_rebuild(self) -> bool:
+        ntotal = self.index.ntotal
+        if ntotal < max(1, self.trained_size) * self.retrain_growth:
+            return False
+        return (choose_index_type(ntotal, self.target) != self.index_type
+                or self.index_type in (INDEX_IVF, INDEX_IVFPQ))
+
+    def reconstruct_all(self) -> np.ndarray:
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.make_direct_map()
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def rebuild(self):
+        return self.build(self.reconstruct_all())
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Tune the recall/latency trade-off of the current index (nprobe for IVF, efSearch for HNSW)"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self.index is None:
+            return
+
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            ivf.nprobe = min(ivf.nlist, self.nprobe or max(1, ivf.nlist // 10))
+        elif isinstance(self.index, faiss.IndexHNSW):
+            self.index.hnsw.efSearch = self.ef_search
@@ -0,0 +1,102 @@
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from index_manager import IndexManager, METRIC_IP, METRIC_L2, QUANT_PQ, QUANT_SQ8, codes_of
+
+# (metric, quantization) variants compared against the float32 L2 index
+CONFIGS: List[Tuple[str, Optional[str]]] = [
+    (METRIC_L2, None),
+    (METRIC_IP, None),
+    (METRIC_L2, QUANT_SQ8),
+    (METRIC_IP, QUANT_SQ8),
+    (METRIC_L2, QUANT_PQ),
+    (METRIC_IP, QUANT_PQ),
+]
+
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def quantization_report(vectors: np.ndarray, queries: np.ndarray, k: int = 10, target: str = "balanced",
+                        configs: List[Tuple[str, Optional[str]]] = CONFIGS) -> List[Dict]:
+    """Recall@k (against exact float32 L2 search), index size and query latency of each config"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    baseline_bytes = index_bytes(exact)
+
+    rows = []
+    for metric, quantization in configs:
+        manager = IndexManager(vectors.shape[1], target=target, metric=metric, quantization=quantization)
+        build_start = time.perf_counter()
+        index = manager.build(vectors)
+        build_seconds = time.perf_counter() - build_start
+
+        search_queries = queries.copy()
+        if metric == METRIC_IP:
+            faiss.normalize_L2(search_queries)
+        search_start = time.perf_counter()
+        _, found = index.search(search_queries, k)
+        search_ms = (time.perf_counter() - search_start) * 1000 / len(queries)
+
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        size = index_bytes(index)
+        rows.append({
+            'metric': metric,
+            # What was built: PQ requests become SQ8 for flat and HNSW indexes
+            'quantization': codes_of(index) or 'float32',
+            'index_type': manager.index_type,
+            f'recall@{k}': float(recall),
+            'bytes': size,
+            'compression': baseline_bytes / size,
+            'build_seconds': build_seconds,
+            'ms_per_query': search_ms
+        })
+    return rows
+
+
+def format_report(rows: List[Dict], k: int) -> str:
+    lines = [f"{'metric':<6} {'codes':<8} {'type':<6} {f'recall@{k}':>9} {'MB':>9} {'ratio':>6} {'ms/q':>7}"]
+    for row in rows:
+        lines.append(f"{row['metric']:<6} {row['quantization']:<8} {row['index_type']:<6} "
+                     f"{row[f'recall@{k}']:>9.3f} {row['bytes'] / 1e6:>9.2f} {row['compression']:>5.1f}x "
+                     f"{row['ms_per_query']:>7.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall and memory of metric/quantization options "
+                                                 "on the vectors of an existing index")
+    parser.add_argument('index', help="index path without suffix (reads {index}.faiss)")
+    parser.add_argument('--queries', type=int, default=200, help="number of stored vectors used as queries")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--target', choices=['recall', 'balanced', 'latency'], default='balanced')
+    parser.add_argument('--output', help="also write the report as JSON")
+    args = parser.parse_args()
+
+    manager = IndexManager()
+    manager.attach(faiss.read_index(f"{args.index}.faiss"))
+    vectors = manager.reconstruct_all()
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    # Perturb the sampled vectors so queries are near, not identical to, stored vectors
+    queries = queries + rng.normal(0, queries.std() * 0.1, queries.shape).astype('float32')
+
+    rows = quantization_report(vectors, queries, k=args.k, target=args.target)
+    print(f"{len(vectors)} vectors, {len(queries)} queries")
+    print(format_report(rows, args.k))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import logging
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from embedding_service import encode
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; a compiled regex is used instead
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+GENERAL = "general"  # knowledge-base documents that apply to every issue type
+DEFAULT_ISSUE_TYPE = "general emotional distress"
+
+# In priority order: when a text hits several categories the first one wins
+ISSUE_KEYWORDS: Dict[str, List[str]] = {
+    "romantic breakup": ["分手", "失恋", "前任", "ex", "离婚", "breakup", "heartbreak", "divorce"],
+    "interpersonal conflict": ["吵架", "争吵", "冲突", "矛盾", "绝交", "误会", "朋友", "室友", "fight",
+                               "argument", "conflict", "quarrel", "contradiction", "break off relations",
+                               "misunderstanding", "friends", "roommate"],
+    "workplace stress": ["工作", "职场", "老板", "同事", "绩效", "加班", "kpi", "裁员", "work", "job", "career",
+                         "workplace", "boss", "colleague", "performance", "overtime", "layoffs"],
+    "mental health": ["焦虑", "抑郁", "压力", "失眠", "情绪", "心理", "难受", "情绪低落", "anxiety", "depressed",
+                      "depression", "sad", "stress", "insomnia", "emotion", "psychology", "discomfort"],
+    "family issues": ["家人", "家庭", "父母", "亲戚", "沟通", "代沟", "family", "parent", "parents", "relatives",
+                      "communication", "generation gap"],
+    "financial stress": ["钱", "经济", "贫穷", "债务", "买不起", "money", "economy", "poverty", "debt", "unaffordable"],
+    "academic anxiety": ["考试", "挂科", "学习", "学业", "论文", "毕业", "gpa", "成绩", "exam", "fail", "study",
+                         "academic", "thesis", "graduation", "grade"],
+}
+
+ISSUE_TYPES = list(ISSUE_KEYWORDS) + [DEFAULT_ISSUE_TYPE]
+
+# Category names written by older knowledge-base builds
+LEGACY_ALIASES = {
+    "breakup": "romantic breakup",
+    "conflict": "interpersonal conflict",
+    "work": "workplace stress",
+    "anxiety": "mental health",
+    "depression": "mental health",
+    "family": "family issues",
+}
+
+
+def canonical_issue_type(name: str) -> str:
+    return LEGACY_ALIASES.get(name, name)
+
+
+def issue_type_aliases(name: str) -> List[str]:
+    """The canonical name plus every legacy name stored for it, for filtering existing indexes"""
+    name = canonical_issue_type(name)
+    return [name] + [legacy for legacy, canonical in LEGACY_ALIASES.items() if canonical == name]
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+
+def _needs_boundary(keyword: str) -> bool:
+    # Short ASCII keywords ("ex", "kpi", "gpa", "sad") would otherwise match inside other words
+    return keyword.isascii() and len(keyword) <= 3
+
+
+class IssueClassifier:
+    """Single-pass keyword classifier for the user's issue type, with an optional embedding fallback"""
+
+    def __init__(self, keywords: Dict[str, List[str]] = None, embedding_fallback: bool = False,
+                 min_similarity: float = 0.35):
+        self.keywords = keywords or ISSUE_KEYWORDS
+        self.categories = list(self.keywords)
+        self.embedding_fallback = embedding_fallback
+        self.min_similarity = min_similarity
+        self._centroids: Optional[np.ndarray] = None
+        self._centroid_lock = threading.Lock()
+
+        entries = [(normalize(keyword), priority)
+                   for priority, category in enumerate(self.categories)
+                   for keyword in self.keywords[category]]
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, priority in entries:
+                # Entries come in priority order, so a keyword listed twice keeps its first category
+                if not self._automaton.exists(keyword):
+                    self._automaton.add_word(keyword, (priority, len(keyword), _needs_boundary(keyword)))
+            self._automaton.make_automaton()
+            logger.info("Issue-type keywords are matched with pyahocorasick")
+        else:
+            self._automaton = None
+            logger.info("pyahocorasick is not installed; issue-type keywords are matched with a regex")
+            # Alternatives in priority order inside a lookahead: every position reports the
+            # highest-priority keyword starting there, overlapping matches included
+            alternatives = []
+            for keyword, priority in entries:
+                pattern = re.escape(keyword)
+                if _needs_boundary(keyword):
+                    pattern = rf"(?<![a-z0-9]){pattern}(?![a-z0-9])"
+                alternatives.append(f"(?P<c{priority}_{len(alternatives)}>{pattern})")
+            self._pattern = re.compile(f"(?=(?:{'|'.join(alternatives)}))")
+
+    def _keyword_priority(self, text: str) -> Optional[int]:
+        """Priority of the first-ranked category with a keyword in text, or None"""
+        best = None
+        if self._automaton is not None:
+            for end, (priority, length, bounded) in self._automaton.iter(text):
+                if bounded:
+                    start = end - length + 1
+                    before = text[start - 1] if start > 0 else ''
+                    after = text[end + 1] if end + 1 < len(text) else ''
+                    if re.match(r'[a-z0-9]', before) or re.match(r'[a-z0-9]', after):
+                        continue
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+        else:
+            for match in self._pattern.finditer(text):
+                priority = int(match.lastgroup[1:].split('_')[0])
+                if best is None or priority < best:
+                    best = priority
+                    if best == 0:
+                        break
+        return best
+
+    def classify(self, text: str, default: str = DEFAULT_ISSUE_TYPE) -> str:
+        return self.classify_batch([text], default=default)[0]
+
+    def classify_batch(self, texts: Sequence[str], default: str = DEFAULT_ISSUE_TYPE) -> List[str]:
+        """Classify many texts; misses are embedded together in one batch when the fallback is on"""
+        results: List[Optional[str]] = []
+        misses = []
+        for i, text in enumerate(texts):
+            priority = self._keyword_priority(normalize(text))
+            if priority is None:
+                results.append(None)
+                misses.append(i)
+            else:
+                results.append(self.categories[priority])
+
+        if misses and self.embedding_fallback:
+            for i, category in zip(misses, self._nearest_centroids([texts[i] for i in misses])):
+                results[i] = category
+        return [result or default for result in results]
+
+    def _nearest_centroids(self, texts: List[str]) -> List[Optional[str]]:
+        centroids = self._get_centroids()
+        similarities = encode(texts, normalize=True) @ centroids.T
+        best = similarities.argmax(axis=1)
+        return [self.categories[b] if similarities[row, b] >= self.min_similarity else None
+                for row, b in enumerate(best)]
+
+    def _get_centroids(self) -> np.ndarray:
+        """Normalized mean embedding of each category's keywords, computed once"""
+        with self._centroid_lock:
+            if self._centroids is None:
+                centroids = np.stack([encode(self.keywords[category], normalize=True).mean(axis=0)
+                                      for category in self.categories])
+                self._centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+            return self._centroids
+
+
+_default_classifier: Optional[IssueClassifier] = None
+_default_lock = threading.Lock()
+
+
+def get_classifier() -> IssueClassifier:
+    global _default_classifier
+    with _default_lock:
+        if _default_classifier is None:
+            _default_classifier = IssueClassifier()
+        return _default_classifier
+
+
+def classify_issue_type(text: str, default: str = DEFAULT_ISSUE_TYPE) -> str:
+    return get_classifier().classify(text, default=default)
+
+
+def classify_batch(texts: Sequence[str], default: str = DEFAULT_ISSUE_TYPE) -> List[str]:
+    return get_classifier().classify_batch(texts, default=default)
@@ -0,0 +1,91 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from sentence_transformers import CrossEncoder
+
+RERANK_MODEL = 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'
+DEFAULT_BUDGET_MS = 300.0
+
+_models: Dict[Tuple[str, str], CrossEncoder] = {}
+_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name: str = RERANK_MODEL, device: Optional[str] = None,
+                      max_length: int = 256) -> CrossEncoder:
+    """Return the process-wide cross-encoder, loading it on first use"""
+    key = (model_name, device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+    with _lock:
+        if key not in _models:
+            _models[key] = CrossEncoder(model_name, device=key[1], max_length=max_length)
+        return _models[key]
+
+
+class Reranker:
+    """Cross-encoder re-ranking under a soft latency budget (a running batch is never interrupted)"""
+
+    def __init__(self, model_name: str = RERANK_MODEL, budget_ms: float = DEFAULT_BUDGET_MS,
+                 batch_size: int = 8, device: Optional[str] = None):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.device = device
+        self._batch_ms: Optional[float] = None  # moving average of one batch's latency
+        self.stats = {'calls': 0, 'over_budget': 0, 'overran': 0}
+        # rerank() runs concurrently for every session; guards _batch_ms and stats
+        self._stats_lock = threading.Lock()
+
+    @property
+    def model(self) -> CrossEncoder:
+        return get_cross_encoder(self.model_name, self.device)
+
+    def warm_up(self):
+        self.model.predict([("warm up", "warm up")])
+
+    def rerank(self, query: str, candidates: List[Dict], top_k: Optional[int] = None,
+               budget_ms: Optional[float] = None) -> List[Dict]:
+        """Candidates sorted by cross-encoder score (stored as 'rerank_score'), cut to top_k"""
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        model = self.model
+        with self._stats_lock:
+            self.stats['calls'] += 1
+
+        start = time.perf_counter()
+        scores: List[float] = []
+        for offset in range(0, len(candidates), self.batch_size):
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._stats_lock:
+                expected_ms = self._batch_ms
+            if expected_ms is not None and elapsed_ms + expected_ms > budget_ms:
+                with self._stats_lock:
+                    self.stats['over_budget'] += 1
+                break
+            batch = candidates[offset:offset + self.batch_size]
+            batch_start = time.perf_counter()
+            scores.extend(float(s) for s in model.predict(
+                [(query, f"{c.get('title', '')}\n{c['content']}") for c in batch],
+                batch_size=self.batch_size, convert_to_numpy=True))
+            batch_ms = (time.perf_counter() - batch_start) * 1000
+            with self._stats_lock:
+                self._batch_ms = batch_ms if self._batch_ms is None else 0.8 * self._batch_ms + 0.2 * batch_ms
+
+        if (time.perf_counter() - start) * 1000 > budget_ms:
+            with self._stats_lock:
+                self.stats['overran'] += 1
+
+        scored = [{**c, 'rerank_score': s} for c, s in zip(candidates, scores)]
+        scored.sort(key=lambda c: c['rerank_score'], reverse=True)
+        ranked = scored + candidates[len(scored):]
+        return ranked[:top_k] if top_k else ranked
+
+
+_default_reranker: Optional[Reranker] = None
+
+
+def get_reranker() -> Reranker:
+    global _default_reranker
+    with _lock:
+        if _default_reranker is None:
+            _default_reranker = Reranker()
+        return _default_reranker
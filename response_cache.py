@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+import faiss
+import numpy as np
+
+from embedding_service import EMBEDDING_DIM
+
+
+class _Scope:
+    def __init__(self, dimension: int):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self.entries: "OrderedDict[int, Dict]" = OrderedDict()  # id -> entry, oldest first
+
+
+class ResponseCache:
+    """In-memory semantic cache of agent responses per scope, with a TTL and a size cap"""
+
+    def __init__(self, threshold: float = 0.92, ttl: float = 6 * 3600, max_entries: int = 1000,
+                 dimension: int = EMBEDDING_DIM):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.dimension = dimension
+        self._scopes: Dict[Hashable, _Scope] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _vector(embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _evict(self, scope: _Scope, now: float):
+        expired = []
+        while scope.entries:
+            entry_id, entry = next(iter(scope.entries.items()))
+            if now - entry['created'] <= self.ttl and len(scope.entries) <= self.max_entries:
+                break
+            expired.append(entry_id)
+            scope.entries.popitem(last=False)
+        if expired:
+            scope.index.remove_ids(np.array(expired, dtype='int64'))
+
+    def lookup(self, embedding: np.ndarray, scope: Hashable) -> Optional[Dict]:
+        """The cached entry ({input, response, created, similarity}) for a similar input, or None"""
+        vector = self._vector(embedding)
+        with self._lock:
+            cached = self._scopes.get(scope)
+            if cached is not None:
+                self._evict(cached, time.time())
+            if cached is None or cached.index.ntotal == 0:
+                self.misses += 1
+                return None
+            similarities, ids = cached.index.search(vector, 1)
+            if ids[0][0] < 0 or similarities[0][0] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {**cached.entries[int(ids[0][0])], 'similarity': float(similarities[0][0])}
+
+    def store(self, embedding: np.ndarray, scope: Hashable, text: str, response: str):
+        vector = self._vector(embedding)
+        with self._lock:
+            cached = self._scopes.setdefault(scope, _Scope(self.dimension))
+            entry_id = self._next_id
+            self._next_id += 1
+            cached.index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+            cached.entries[entry_id] = {'input': text, 'response': response, 'created': time.time()}
+            self._evict(cached, time.time())
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': sum(len(scope.entries) for scope in self._scopes.values()),
+                'hit_rate': self.hits / total if total else 0.0
+            }
@@ -0,0 +1,80 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from chunker import TokenCounter, estimate_tokens, split_sentences
+from embedding_service import encode, encode_query
+
+REFERENCE_TEMPLATE = "【Reference {n}】Source: {source}\nTitle: {title}\nContent: {content}"
+
+
+class RetrievalPolicy:
+    """Choose the references for {rag_context} by cosine threshold, adaptive k and a token budget"""
+
+    def __init__(self, min_similarity: float = 0.35, relative_drop: float = 0.15, max_k: int = 3,
+                 token_budget: int = 400, count_tokens: Optional[TokenCounter] = None):
+        # Cosine of paraphrase-multilingual-MiniLM-L12-v2 embeddings, whatever the index metric.
+        # A hand-picked starting point, not tuned on this corpus: with this model, unrelated
+        # sentence pairs usually score below about 0.3 and paraphrases well above 0.5. To
+        # calibrate, label logged (query, reference) pairs as relevant or not and pick the
+        # cosine that separates them. Redo this whenever the embedding model changes.
+        self.min_similarity = min_similarity
+        self.relative_drop = relative_drop
+        self.max_k = max_k
+        self.token_budget = token_budget
+        # Model-agnostic estimate: the agents' LLM tokenizers differ from the embedding model's
+        self.count_tokens = count_tokens or estimate_tokens
+
+    def score(self, query: str, candidates: List[Dict]) -> List[Dict]:
+        """Copies of candidates with a 'similarity' field (cosine to the query)"""
+        missing = [c for c in candidates if 'similarity' not in c]
+        if not missing:
+            return [dict(c) for c in candidates]
+        query_emb = encode_query(query)[0]
+        query_emb = query_emb / (np.linalg.norm(query_emb) or 1.0)
+        # Content only, as it is indexed
+        doc_embs = encode([c['content'] for c in missing], normalize=True)
+        computed = {id(c): float(s) for c, s in zip(missing, doc_embs @ query_emb)}
+        return [{**c, 'similarity': c['similarity'] if 'similarity' in c else computed[id(c)]} for c in candidates]
+
+    def select(self, query: str, candidates: List[Dict]) -> List[Dict]:
+        """Relevant candidates in their retrieval order, at most max_k"""
+        scored = self.score(query, candidates)
+        if not scored:
+            return []
+        best = max(c['similarity'] for c in scored)
+        floor = max(self.min_similarity, best - self.relative_drop)
+        return [c for c in scored if c['similarity'] >= floor][:self.max_k]
+
+    def _truncate(self, text: str, budget: int) -> str:
+        """Longest prefix of whole sentences within budget tokens ('' if not even one fits)"""
+        kept = ''
+        for _, end in split_sentences(text):
+            if self.count_tokens([text[:end]])[0] > budget:
+                break
+            kept = text[:end]
+        return kept
+
+    def format_context(self, references: List[Dict]) -> Tuple[str, List[Dict]]:
+        """Context text within token_budget and the references it actually contains"""
+        parts = []
+        used = []
+        remaining = self.token_budget
+        for reference in references:
+            header = REFERENCE_TEMPLATE.format(n=len(parts) + 1, source=reference.get('source', ''),
+                                               title=reference.get('title', ''), content='')
+            content_budget = remaining - self.count_tokens([header])[0]
+            if content_budget <= 0:
+                break
+            content = reference['content']
+            if self.count_tokens([content])[0] > content_budget:
+                content = self._truncate(content, content_budget)
+                if not content:
+                    break
+            parts.append(header + content)
+            used.append(reference)
+            remaining -= self.count_tokens([parts[-1]])[0]
+        return "\n\n".join(parts), used
+
+    def build_context(self, query: str, candidates: List[Dict]) -> Tuple[str, List[Dict]]:
+        return self.format_context(self.select(query, candidates))
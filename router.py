@@ -0,0 +1,217 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from agent_runner import AGENT_TIMEOUT
+
+# Overall deadlines, split evenly over the providers still to be tried: streaming must start
+# within FIRST_OUTPUT_DEADLINE, a full answer must arrive within ANSWER_DEADLINE. The latter is
+# kept below the agent runner's AGENT_TIMEOUT so the last fallback still gets its turn.
+FIRST_OUTPUT_DEADLINE = 45.0
+ANSWER_DEADLINE = AGENT_TIMEOUT - 10.0
+DEFAULT_HEDGE_DELAY = 8.0  # hedge delay until a provider has enough latency samples
+MIN_HEDGE_DELAY = 2.0
+
+
+class ProviderStats:
+    """Rolling latency and error statistics per provider over the last window seconds"""
+
+    def __init__(self, window: float = 600, min_samples: int = 5):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}  # provider -> (time, latency, or None for an error)
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, latency: Optional[float]):
+        """Record a successful call (its latency in seconds) or, with latency=None, a failed one"""
+        with self._lock:
+            self._samples.setdefault(provider, deque()).append((time.monotonic(), latency))
+
+    def _recent(self, provider: str) -> List[Optional[float]]:
+        with self._lock:
+            samples = self._samples.get(provider)
+            if not samples:
+                return []
+            cutoff = time.monotonic() - self.window
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            return [latency for _, latency in samples]
+
+    def percentile(self, provider: str, q: float) -> Optional[float]:
+        """q-quantile of the recent latencies, None with fewer than min_samples successes"""
+        latencies = sorted(latency for latency in self._recent(provider) if latency is not None)
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def p95(self, provider: str) -> Optional[float]:
+        return self.percentile(provider, 0.95)
+
+    def error_rate(self, provider: str) -> float:
+        recent = self._recent(provider)
+        if len(recent) < self.min_samples:
+            return 0.0
+        return sum(latency is None for latency in recent) / len(recent)
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            providers = list(self._samples)
+        rows = {}
+        for provider in providers:
+            recent = self._recent(provider)
+            if recent:
+                rows[provider] = {
+                    'requests': len(recent),
+                    'errors': sum(latency is None for latency in recent),
+                    'p50': self.percentile(provider, 0.5),
+                    'p95': self.p95(provider)
+                }
+        return rows
+
+
+provider_stats = ProviderStats()
+
+
+class ProviderRouter:
+    """Run a call against ordered providers with fallback and optional hedging"""
+
+    def __init__(self, providers: Sequence[str], stats: ProviderStats = provider_stats, hedge: bool = False,
+                 first_output_deadline: float = FIRST_OUTPUT_DEADLINE, answer_deadline: float = ANSWER_DEADLINE,
+                 max_error_rate: float = 0.5):
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = list(providers)
+        self.stats = stats
+        self.hedge = hedge
+        self.first_output_deadline = first_output_deadline
+        self.answer_deadline = answer_deadline
+        self.max_error_rate = max_error_rate
+
+    @staticmethod
+    def stats_key(provider: str, full_answer: bool = False) -> str:
+        return f"{provider} (full answer)" if full_answer else provider
+
+    def order(self, full_answer: bool = False) -> List[str]:
+        def p95(provider):
+            return self.stats.p95(self.stats_key(provider, full_answer))
+
+        primary, fallbacks = self.providers[0], self.providers[1:]
+        fallbacks.sort(key=lambda p: (p95(p) is None, p95(p) or 0.0))
+        ordered = [primary] + fallbacks
+        healthy = [p for p in ordered
+                   if self.stats.error_rate(self.stats_key(p, full_answer)) < self.max_error_rate]
+        return healthy + [p for p in ordered if p not in healthy]
+
+    def hedge_delay(self, provider: str, full_answer: bool = False) -> float:
+        p95 = self.stats.p95(self.stats_key(provider, full_answer))
+        return DEFAULT_HEDGE_DELAY if p95 is None else max(MIN_HEDGE_DELAY, p95)
+
+    def _attempt(self, call: Callable[[str], Any], provider: str, key: str, cancelled: threading.Event,
+                 events: "queue.Queue"):
+        start = time.monotonic()
+        answered = False
+        try:
+            result = call(provider)
+            chunks = [result] if result is None or isinstance(result, str) else result
+            for delta in chunks:
+                if cancelled.is_set():
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+                    return
+                if not delta:
+                    continue
+                if not answered:
+                    answered = True
+                    self.stats.record(key, time.monotonic() - start)
+                events.put((provider, delta, None))
+            if not answered:
+                self.stats.record(key, time.monotonic() - start)
+            events.put((provider, None, None))
+        except Exception as e:
+            if not cancelled.is_set():
+                self.stats.record(key, None)
+            e.provider = provider
+            events.put((provider, None, e))
+
+    def stream(self, call: Callable[[str], Any]) -> Iterator[str]:
+        """Yield the text deltas of call(provider), an iterator of text deltas, from the provider that answers.
+
+        If every provider fails, the last error is raised.
+        """
+        return self._route(call, full_answer=False)
+
+    def run(self, call: Callable[[str], Any]) -> str:
+        """The text returned by call(provider) from the provider that answers"""
+        return "".join(self._route(call, full_answer=True))
+
+    def _route(self, call: Callable[[str], Any], full_answer: bool) -> Iterator[str]:
+        candidates = self.order(full_answer)
+        route_deadline = time.monotonic() + (self.answer_deadline if full_answer else self.first_output_deadline)
+        timeout = 0.0
+        events = queue.Queue()
+        cancels: Dict[str, threading.Event] = {}
+        running = set()
+        winner = None
+        last_error: Optional[Exception] = None
+
+        def start_next() -> float:
+            nonlocal timeout
+            provider = candidates[len(cancels)]
+            now = time.monotonic()
+            # This provider and every untried one get an equal share of what is left
+            timeout = max(0.0, route_deadline - now) / (len(candidates) - len(cancels))
+            cancels[provider] = threading.Event()
+            running.add(provider)
+            threading.Thread(target=self._attempt,
+                             args=(call, provider, self.stats_key(provider, full_answer), cancels[provider], events),
+                             name=f"route-{provider}", daemon=True).start()
+            if self.hedge and len(cancels) < len(candidates):
+                return now + min(self.hedge_delay(provider, full_answer), timeout)
+            return now + timeout
+
+        deadline = start_next()
+        try:
+            while True:
+                try:
+                    wait = None if winner else max(0.0, deadline - time.monotonic())
+                    provider, delta, error = events.get(timeout=wait)
+                except queue.Empty:
+                    if not (self.hedge and len(cancels) < len(candidates)):
+                        # Nothing within the timeout: abandon the running providers
+                        for slow in running:
+                            cancels[slow].set()
+                            self.stats.record(self.stats_key(slow, full_answer), None)
+                        last_error = TimeoutError(f"{', '.join(sorted(running))} did not answer within {timeout:.0f}s")
+                        last_error.provider = ', '.join(sorted(running))
+                        running.clear()
+                        if len(cancels) == len(candidates):
+                            raise last_error
+                    deadline = start_next()
+                    continue
+
+                if winner is None:
+                    if provider not in running:
+                        continue
+                    if error is not None:
+                        running.discard(provider)
+                        last_error = error
+                        if not running:
+                            if len(cancels) == len(candidates):
+                                raise error
+                            deadline = start_next()
+                        continue
+                    winner = provider
+                    for other in running - {provider}:
+                        cancels[other].set()
+                if provider != winner:
+                    continue
+                if error is not None:
+                    raise error
+                if delta is None:
+                    return
+                yield delta
+        finally:
+            for cancelled in cancels.values():
+                cancelled.set()
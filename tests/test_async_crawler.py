@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+test_utils = pytest.importorskip("aiohttp.test_utils")
+web = pytest.importorskip("aiohttp.web")
+async_crawler = pytest.importorskip("async_crawler")  # also needs the synchronous crawler's deps
+
+from async_crawler import AsyncPsychologyCrawler, TokenBucket
+from crawl_state import CrawlState
+
+
+async def serve(handler, use):
+    """Run use(session, base_url) against a local test server whose every GET goes to handler"""
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', handler)
+    async with test_utils.TestServer(app) as server:
+        async with aiohttp.ClientSession() as session:
+            return await use(session, str(server.make_url('/')))
+
+
+def test_token_bucket_limits_the_rate():
+    async def take(count):
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        await asyncio.gather(*[bucket.acquire() for _ in range(count)])
+        return time.monotonic() - start
+
+    # Two tokens are available at once, the next four come at 20 per second
+    assert asyncio.run(take(2)) < 0.05
+    assert asyncio.run(take(6)) >= 4 / 20 - 0.02
+
+
+def test_retries_with_backoff_and_honours_retry_after():
+    calls = []
+
+    async def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if len(calls) == 2:
+            return web.Response(status=503)
+        return web.Response(text="ok")
+
+    crawler = AsyncPsychologyCrawler(rate_per_host=1000, burst=10, backoff=0.01)
+    result = asyncio.run(serve(handler, lambda session, url: crawler.fetch(session, url)))
+
+    assert result.body == "ok"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 1.0  # waited for Retry-After
+    assert calls[2] - calls[1] < 1.0  # plain exponential backoff
+
+
+def test_gives_up_after_max_retries():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return web.Response(status=503)
+
+    crawler = AsyncPsychologyCrawler(rate_per_host=1000, burst=10, backoff=0.01, max_retries=2)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(serve(handler, lambda session, url: crawler.fetch(session, url)))
+    assert len(calls) == 3
+
+
+def test_conditional_get_reports_unchanged_records(tmp_path):
+    seen_headers = []
+
+    async def handler(request):
+        seen_headers.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        return web.Response(text="page body", headers={'ETag': '"v1"'})
+
+    state = CrawlState(str(tmp_path / "crawl_state.db"))
+    crawler = AsyncPsychologyCrawler(rate_per_host=1000, burst=10, state=state)
+
+    def parse(body):
+        return [{'url': 'record-1', 'content': body}]
+
+    async def crawl_twice(session, url):
+        first = await crawler.crawl_page(session, url, parse)
+        staged = await crawler.crawl_page(session, url, parse)
+        # Staged pages only count as seen once the dump has been indexed
+        committed = state.commit_pending()
+        return first, staged, committed, await crawler.crawl_page(session, url, parse)
+
+    first, staged, committed, second = asyncio.run(serve(handler, crawl_twice))
+    assert first == staged == [{'url': 'record-1', 'content': "page body"}]
+    assert committed == 1
+    assert second == [{'url': 'record-1', 'unchanged': True}]
+    assert seen_headers == [None, None, '"v1"']
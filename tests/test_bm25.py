@@ -0,0 +1,61 @@
+import sqlite3
+
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+from document_store import DocumentStore
+
+DOCS = [
+    {'title': 'Breathing', 'content': 'slow breathing calms anxiety before an exam', 'url': 'a'},
+    {'title': 'Sleep', 'content': 'a regular sleep schedule helps with insomnia', 'url': 'b'},
+    {'title': '失眠', 'content': '失眠的时候可以尝试放松训练', 'url': 'c'},
+]
+
+
+def make_index(path) -> BM25Index:
+    store = DocumentStore(str(path))
+    # Fail fast instead of waiting out sqlite's default 5 s busy timeout
+    store.conn.execute("PRAGMA busy_timeout = 200")
+    return BM25Index(store)
+
+
+def test_search_ranks_matching_documents(tmp_path):
+    index = make_index(tmp_path / "kb.db")
+    ids = index.store.add_many(DOCS)
+    index.add_many(ids, DOCS)
+
+    assert [doc_id for doc_id, _ in index.search("insomnia sleep")][0] == ids[1]
+    assert index.search("失眠")[0][0] == ids[2]
+
+    index.remove([ids[1]])
+    assert ids[1] not in [doc_id for doc_id, _ in index.search("insomnia sleep")]
+
+
+def test_second_connection_is_not_locked_out(tmp_path):
+    path = tmp_path / "kb.db"
+    first = make_index(path)
+    try:
+        second = make_index(path)
+        ids = second.store.add_many(DOCS[:1])
+        second.add_many(ids, DOCS[:1])
+        second.store.commit()
+    except sqlite3.OperationalError as e:  # "database is locked"
+        raise AssertionError(f"opening the index twice failed: {e}")
+
+    # The first connection sees what the second one committed
+    assert first.store.live_count() == 1
+    assert first.search("breathing")[0][0] == ids[0]
+
+
+def test_stale_index_is_rebuilt_on_open(tmp_path):
+    path = tmp_path / "kb.db"
+    store = DocumentStore(str(path))
+    store.add_many(DOCS)
+    store.commit()
+    store.close()
+
+    index = make_index(path)
+    assert index.search("exam")[0][0] == 0
+
+
+def test_tokenize_and_fusion():
+    assert tokenize("5-4-3-2-1 Grounding") == ['5-4-3-2-1', 'grounding']
+    assert reciprocal_rank_fusion([[1, 2], [2, 3]])[0][0] == 2
@@ -0,0 +1,69 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from concurrency import FileLock, SingleWriter, atomic_write
+
+
+def increment(counter_path: str, lock_path: str, times: int):
+    for _ in range(times):
+        with FileLock(lock_path):
+            with open(counter_path) as f:
+                value = int(f.read())
+            time.sleep(0.001)  # widen the race window
+            with open(counter_path, 'w') as f:
+                f.write(str(value + 1))
+
+
+def test_file_lock_serializes_processes_and_threads(tmp_path):
+    counter = tmp_path / "counter"
+    counter.write_text("0")
+    args = (str(counter), str(tmp_path / "counter.lock"), 20)
+
+    processes = [multiprocessing.Process(target=increment, args=args) for _ in range(3)]
+    threads = [threading.Thread(target=increment, args=args) for _ in range(2)]
+    for worker in processes + threads:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert counter.read_text() == str(5 * 20)
+
+
+def test_single_writer_runs_jobs_in_order(tmp_path):
+    writer = SingleWriter(lock_path=str(tmp_path / "writer.lock"))
+    seen = []
+    try:
+        futures = [writer.submit(seen.append, i) for i in range(50)]
+        for future in futures:
+            future.result(timeout=5)
+        assert seen == list(range(50))
+
+        # A job calling back into the writer runs inline instead of deadlocking
+        assert writer.call(lambda: writer.call(lambda: "nested")) == "nested"
+
+        with pytest.raises(ValueError):
+            writer.call(int, "not a number")
+    finally:
+        writer.close()
+
+
+def test_atomic_write_leaves_old_file_on_failure(tmp_path):
+    target = tmp_path / "data.txt"
+    target.write_text("old")
+
+    def failing_write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            f.write("partial")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_write(str(target), failing_write)
+    assert target.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["data.txt"]
+
+    atomic_write(str(target), lambda tmp: open(tmp, 'w').write("new"))
+    assert target.read_text() == "new"
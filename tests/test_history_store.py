@@ -0,0 +1,99 @@
+import json
+import multiprocessing
+from datetime import datetime, timedelta
+
+import pytest
+
+from history_store import HistoryStore, _ISSUE_CODES
+
+START = datetime(2025, 1, 1, 12, 0)
+
+
+def entry(minute: int, issue_type: str = "mental health", **extra):
+    return {'timestamp': (START + timedelta(minutes=minute)).isoformat(), 'input': f"input {minute}",
+            'response': f"response {minute}", 'issue_type': issue_type, **extra}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.jsonl"), legacy_path=None)
+
+
+def test_query_by_time_and_issue_type(store):
+    store.append_many([entry(i, "family issues" if i % 2 else "mental health") for i in range(10)])
+
+    assert [e['input'] for e in store.query(START + timedelta(minutes=3), START + timedelta(minutes=6))] == \
+        ["input 3", "input 4", "input 5"]
+    assert [e['input'] for e in store.query(issue_type="family issues", limit=2)] == ["input 1", "input 3"]
+    assert [e['input'] for e in store.tail(2)] == ["input 8", "input 9"]
+
+
+def test_unknown_issue_type_is_filtered_before_the_limit(store):
+    store.append_many([entry(0, "astrology"), entry(1, "gardening"), entry(2, "gardening")])
+
+    assert [e['input'] for e in store.query(issue_type="gardening", limit=1)] == ["input 1"]
+
+
+def test_index_survives_reopening(store, tmp_path):
+    store.append_many([entry(i) for i in range(3)])
+    reopened = HistoryStore(str(tmp_path / "history.jsonl"), legacy_path=None)
+    assert len(reopened) == 3
+    assert reopened.get(-1)['input'] == "input 2"
+
+
+def test_query_by_session(store):
+    store.append_many([entry(i, session_id="a" if i < 2 else "b") for i in range(4)] + [entry(4)])
+
+    assert [e['input'] for e in store.query(session_id="a")] == ["input 0", "input 1"]
+    assert [e['input'] for e in store.query(session_id="b", limit=1)] == ["input 2"]
+
+
+def test_older_index_format_is_rebuilt(store, tmp_path):
+    store.append_many([entry(0, session_id="a"), entry(1, session_id="b")])
+    # An index written before the header and session column existed
+    (tmp_path / "history.jsonl.idx").write_bytes(b'\0' * 22)
+
+    reopened = HistoryStore(str(tmp_path / "history.jsonl"), legacy_path=None)
+    assert [e['input'] for e in reopened.query(session_id="b")] == ["input 1"]
+
+
+def test_legacy_file_is_found_next_to_the_store(tmp_path, monkeypatch):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "conversation_history.json").write_text(json.dumps([entry(0), entry(1)]), encoding='utf-8')
+    # A legacy file in the working directory belongs to another store
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "conversation_history.json").write_text(json.dumps([entry(5)]), encoding='utf-8')
+
+    store = HistoryStore(str(tmp_path / "data" / "history.jsonl"))
+    assert [e['input'] for e in store] == ["input 0", "input 1"]
+    assert (tmp_path / "data" / "conversation_history.json.migrated").exists()
+    assert (tmp_path / "conversation_history.json").exists()
+
+
+def append_entries(path: str, session: str, count: int):
+    store = HistoryStore(path, legacy_path=None)
+    for i in range(count):
+        store.append(entry(i, session_id=session))
+
+
+def test_appends_from_several_processes(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    store = HistoryStore(path, legacy_path=None)
+    processes = [multiprocessing.Process(target=append_entries, args=(path, session, 25)) for session in "abcd"]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    # The open store picks up entries appended by the other processes
+    assert len(store) == 100
+    assert len(list(store)) == 100
+    for session in "abcd":
+        assert [e['input'] for e in store.query(session_id=session)] == [f"input {i}" for i in range(25)]
+
+
+def test_issue_codes_cover_every_issue_type():
+    issue_classifier = pytest.importorskip("issue_classifier")
+    assert set(issue_classifier.ISSUE_TYPES) <= set(_ISSUE_CODES)
+    assert len(set(_ISSUE_CODES.values())) == len(_ISSUE_CODES)
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+import router
+from router import ProviderRouter, ProviderStats
+
+
+def make_call(behaviour):
+    """call(provider) following behaviour[provider] = (kind, delay); kind is text, stream or error"""
+    def call(provider):
+        kind, delay = behaviour[provider]
+        time.sleep(delay)
+        if kind == "error":
+            raise RuntimeError(f"{provider} failed")
+        if kind == "stream":
+            return iter([f"{provider} ", "answer"])
+        return f"{provider} answer"
+    return call
+
+
+def test_falls_back_when_the_preferred_provider_fails():
+    stats = ProviderStats(min_samples=1)
+    answer = ProviderRouter(["a", "b"], stats=stats).run(make_call({"a": ("error", 0), "b": ("text", 0)}))
+
+    assert answer == "b answer"
+    assert stats.error_rate(ProviderRouter.stats_key("a", full_answer=True)) == 1.0
+
+
+def test_the_last_error_names_its_provider():
+    with pytest.raises(RuntimeError) as raised:
+        ProviderRouter(["a", "b"], stats=ProviderStats()).run(make_call({"a": ("error", 0), "b": ("error", 0)}))
+    assert raised.value.provider == "b"
+
+
+def test_deadline_is_split_so_the_fallback_still_runs():
+    # Neither provider alone may use the whole deadline, or b would never get its turn
+    route = ProviderRouter(["a", "b"], stats=ProviderStats(), answer_deadline=0.6)
+    start = time.monotonic()
+    answer = route.run(make_call({"a": ("text", 2), "b": ("text", 0.05)}))
+
+    assert answer == "b answer"
+    assert time.monotonic() - start < 0.6
+
+
+def test_times_out_within_the_overall_deadline():
+    route = ProviderRouter(["a", "b", "c"], stats=ProviderStats(), first_output_deadline=0.3)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError) as raised:
+        list(route.stream(make_call({"a": ("stream", 2), "b": ("stream", 2), "c": ("stream", 2)})))
+
+    assert time.monotonic() - start < 0.5
+    assert raised.value.provider == "c"
+
+
+def test_hedged_stream_uses_the_faster_provider(monkeypatch):
+    monkeypatch.setattr(router, "DEFAULT_HEDGE_DELAY", 0.05)
+    route = ProviderRouter(["slow", "fast"], stats=ProviderStats(), hedge=True)
+
+    assert "".join(route.stream(make_call({"slow": ("stream", 1), "fast": ("stream", 0)}))) == "fast answer"
+
+
+def test_unhealthy_providers_are_tried_last():
+    stats = ProviderStats(min_samples=2)
+    for _ in range(2):
+        stats.record("b", None)
+        stats.record("c", 0.1)
+
+    assert ProviderRouter(["a", "b", "c"], stats=stats).order() == ["a", "c", "b"]
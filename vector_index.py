@@ -1,65 +1,166 @@
 import faiss
 import numpy as np
-import pickle
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple, Dict
+import time
+from pathlib import Path
+from bm25 import BM25Index, reciprocal_rank_fusion
+from document_store import DocumentStore
+from embedding_service import get_embedding_model, encode, encode_query, EmbeddingPool, EMBEDDING_DIM, DEFAULT_BATCH_SIZE
+from index_manager import IndexManager, filtered_search, similarity_score, write_index_atomic, METRIC_L2
+from issue_classifier import issue_type_aliases
+from typing import List, Tuple, Dict, Optional
 
 
 class VectorIndex:
 
-    def __init__(self, dimension: int = 384):
+    def __init__(self, dimension: int = EMBEDDING_DIM, target: str = "balanced",
+                 nprobe: Optional[int] = None, ef_search: int = 64, store_path: str = ":memory:",
+                 metric: str = METRIC_L2, quantization: Optional[str] = None):
         self.dimension = dimension
-        self.index = None
-        self.knowledge_base = []
-        self.embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-
-    def build_index(self, knowledge_base: List[Dict]):
-        self.knowledge_base = knowledge_base
+        self.index_manager = IndexManager(dimension, target=target, nprobe=nprobe, ef_search=ef_search,
+                                          metric=metric, quantization=quantization)
+        self.store = DocumentStore(store_path)
+        self.bm25 = BM25Index(self.store)
+        self.deleted_ids = set(self.store.deleted_ids())
+
+    @property
+    def index(self):
+        return self.index_manager.index
+
+    @property
+    def embedding_model(self):
+        return get_embedding_model()
+
+    def build_index(self, knowledge_base: List[Dict], batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 1):
+        self.store.clear()
+        self.bm25.clear()
+        ids = self.store.add_many(knowledge_base, start_id=0)
+        self.bm25.add_many(ids, knowledge_base)
+        self.store.commit()
+        self.deleted_ids = set()
 
         texts = [item['content'] for item in knowledge_base]
-        embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
+        start = time.monotonic()
+        if workers > 1:
+            with EmbeddingPool(workers) as pool:
+                embeddings = pool.encode(texts, batch_size=batch_size)
+        else:
+            embeddings = encode(texts, batch_size=batch_size, show_progress_bar=True)
+        elapsed = max(time.monotonic() - start, 1e-9)
 
-        quantizer = faiss.IndexFlatL2(self.dimension)
-        nlist = min(100, max(1, len(knowledge_base) // 10))
-        self.index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist)
+        self.index_manager.build(embeddings)
 
-        self.index.train(embeddings.astype('float32'))
-        self.index.add(embeddings.astype('float32'))
+        print(f"索引构建完成，共 {self.index.ntotal} 条知识 (索引类型: {self.index_manager.index_type}, "
+              f"{workers} 个进程编码 {len(texts) / elapsed:.1f} 条/秒)")
 
-        print(f"索引构建完成，共 {self.index.ntotal} 条知识")
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        self.index_manager.set_search_params(nprobe=nprobe, ef_search=ef_search)
 
-    def search(self, query: str, k: int = 5, issue_type: str = None) -> List[Dict]:
-        query_emb = self.embedding_model.encode([query])
+    def _allowed_ids(self, issue_type: Optional[str]) -> Optional[List[int]]:
+        return self.store.ids_for_issue_types(issue_type_aliases(issue_type)) if issue_type else None
 
-        distances, indices = self.index.search(query_emb.astype('float32'), min(k * 2, self.index.ntotal))
+    def _dense_hits(self, query: str, k: int, allowed_ids: Optional[List[int]]) -> List[Tuple[int, float]]:
+        query_emb = encode_query(query)
+        distances, indices = filtered_search(self.index, query_emb, k, allowed_ids, self.deleted_ids)
+        return [(int(idx), float(dist)) for idx, dist in zip(indices[0], distances[0]) if idx != -1]
+
+    def _to_results(self, hits: List[Tuple[int, float]], k: int) -> List[Dict]:
+        """Fetch (id, score) hits from the store in order, skipping ids that no longer exist"""
+        docs = self.store.get_many([idx for idx, _ in hits])
 
         results = []
-        for idx, dist in zip(indices[0], distances[0]):
-            if idx == -1 or idx >= len(self.knowledge_base):
+        for (idx, score), item in zip(hits, docs):
+            if item is None:
                 continue
 
-            item = self.knowledge_base[idx]
-
-            if issue_type and item.get('issue_type'):
-                if item.get('issue_type') != issue_type:
-                    continue
-
             results.append({
                 'content': item['content'],
                 'title': item['title'],
                 'source': item['source'],
-                'score': float(1 / (1 + dist)),
+                'score': score,
                 'type': item.get('type', 'unknown')
             })
 
         return results[:k]
 
+    def search(self, query: str, k: int = 5, issue_type: str = None) -> List[Dict]:
+        hits = self._dense_hits(query, k, self._allowed_ids(issue_type))
+        return self._to_results([(idx, similarity_score(self.index, dist)) for idx, dist in hits], k)
+
+    def keyword_search(self, query: str, k: int = 5, issue_type: str = None) -> List[Dict]:
+        """BM25-only search; scores are raw BM25 scores"""
+        hits = self.bm25.search(query, k, self._allowed_ids(issue_type), self.deleted_ids)
+        return self._to_results(hits, k)
+
+    def hybrid_search(self, query: str, k: int = 5, issue_type: str = None, dense_k: Optional[int] = None,
+                      sparse_k: Optional[int] = None, rrf_k: int = 60) -> List[Dict]:
+        """Dense and BM25 results fused with reciprocal rank fusion; scores are RRF scores.
+
+        Exact terms (technique names such as "5-4-3-2-1" or "番茄工作法") are found by BM25 even
+        when the embedding misses them, so dense_k can stay small.
+        """
+        allowed_ids = self._allowed_ids(issue_type)
+        dense = self._dense_hits(query, dense_k or k, allowed_ids)
+        sparse = self.bm25.search(query, sparse_k or 2 * k, allowed_ids, self.deleted_ids)
+        fused = reciprocal_rank_fusion([[idx for idx, _ in dense], [idx for idx, _ in sparse]], k=rrf_k)
+        return self._to_results(fused[:2 * k], k)
+
+    def reset(self):
+        """Drop every document and the index (the store file itself is kept)"""
+        self.store.clear()
+        self.bm25.clear()
+        self.store.commit()
+        self.index_manager.index = None
+        self.deleted_ids = set()
+
+    def add_documents(self, docs: List[Dict], batch_size: int = DEFAULT_BATCH_SIZE,
+                      embeddings: Optional[np.ndarray] = None) -> List[int]:
+        """Append docs (embedding them unless embeddings are given) to the index and the store; returns their ids"""
+        if not docs:
+            return []
+        if embeddings is None:
+            embeddings = encode([doc['content'] for doc in docs], batch_size=batch_size)
+        start_id = self.index.ntotal if self.index is not None else 0
+        self.index_manager.add(embeddings)
+        ids = self.store.add_many(docs, start_id=start_id)
+        self.bm25.add_many(ids, docs)
+        return ids
+
+    def remove_urls(self, urls: List[str]) -> List[int]:
+        """Tombstone every chunk of the given URLs; they are excluded from all later searches"""
+        ids = self.store.tombstone_urls(urls)
+        self.bm25.remove(ids)
+        self.deleted_ids.update(ids)
+        return ids
+
+    def upsert(self, url: str, docs: List[Dict], batch_size: int = DEFAULT_BATCH_SIZE,
+               embeddings: Optional[np.ndarray] = None) -> List[int]:
+        """Replace the chunks previously indexed for url with docs"""
+        self.remove_urls([url])
+        return self.add_documents(docs, batch_size=batch_size, embeddings=embeddings)
+
     def save(self, path: str):
-        faiss.write_index(self.index, f"{path}.faiss")
-        with open(f"{path}.pkl", 'wb') as f:
-            pickle.dump(self.knowledge_base, f)
-
-    def load(self, path: str):
-        self.index = faiss.read_index(f"{path}.faiss")
-        with open(f"{path}.pkl", 'rb') as f:
-            self.knowledge_base = pickle.load(f)
\ No newline at end of file
+        write_index_atomic(self.index, f"{path}.faiss")
+        if Path(self.store.path).resolve() != Path(f"{path}.db").resolve():
+            self.store.backup_to(f"{path}.db")
+        else:
+            self.store.commit()
+
+    def load(self, path: str, mmap: bool = True):
+        """Load an index saved by save(); legacy .pkl metadata is migrated to .db on first load.
+
+        mmap=True passes IO_FLAG_MMAP, which only memory-maps the inverted lists of IVF indexes
+        (shared between processes, read-only). Flat and HNSW indexes are read fully into each
+        process either way.
+        """
+        flags = faiss.IO_FLAG_MMAP if mmap else 0
+        self.index_manager.attach(faiss.read_index(f"{path}.faiss", flags))
+
+        db_path = Path(f"{path}.db")
+        pkl_path = Path(f"{path}.pkl")
+        self.store.close()
+        needs_migration = not db_path.exists() and pkl_path.exists()
+        self.store = DocumentStore(str(db_path))
+        if needs_migration:
+            self.store.import_pickle(str(pkl_path))
+        self.bm25 = BM25Index(self.store)
+        self.deleted_ids = set(self.store.deleted_ids())